@@ -0,0 +1,122 @@
+from http.server import BaseHTTPRequestHandler
+import hmac
+import json
+import os
+import time
+import urllib.parse
+
+from api.storage import get_storage
+
+# Token de acesso ao painel administrativo
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# Conjuntos de chaves exportáveis (na ordem da exportação)
+EXPORT_SCOPES = {
+    "monitors": "monitors:*",
+    "state": "state:*",
+}
+
+# Chaves pedidas por SCAN (dica para o Redis) e tempo máximo por resposta
+SCAN_COUNT = 500
+EXPORT_TIME_BUDGET = 8
+
+
+def parse_cursor(token, scopes):
+    """Interpreta o cursor retomável no formato '<escopo>:<cursor do scan>'."""
+    if not token:
+        return 0, "0"
+    scope, _, scan_cursor = token.partition(":")
+    if scope not in scopes or not scan_cursor:
+        raise ValueError("Cursor inválido")
+    return scopes.index(scope), scan_cursor
+
+
+def export_chunks(scopes, cursor=None, deadline=None):
+    """Gera linhas NDJSON percorrendo as chaves com SCAN.
+
+    A última linha sempre traz o cursor para retomar a exportação;
+    "done" indica que todos os escopos foram percorridos.
+    """
+    scope_index, scan_cursor = parse_cursor(cursor, scopes)
+    storage = get_storage()
+
+    while scope_index < len(scopes):
+        scope = scopes[scope_index]
+        try:
+            next_cursor, keys = storage.scan(scan_cursor, EXPORT_SCOPES[scope], SCAN_COUNT)
+            # Sessões e monitoramentos são strings: um MGET por lote
+            values = storage.mget(keys) if keys else []
+        except IOError as e:
+            # Para no lote que falhou: o cursor retoma a partir dele, sem pular chaves
+            yield json.dumps({"error": str(e), "cursor": f"{scope}:{scan_cursor}", "done": False}) + "\n"
+            return
+
+        scan_cursor = next_cursor
+        if keys:
+            lines = [
+                json.dumps({"scope": scope, "key": key, "value": value}, ensure_ascii=False)
+                for key, value in zip(keys, values)
+            ]
+            yield "\n".join(lines) + "\n"
+
+        if scan_cursor == "0":
+            scope_index += 1
+
+        if deadline and time.monotonic() > deadline:
+            break
+
+    if scope_index < len(scopes):
+        yield json.dumps({"cursor": f"{scopes[scope_index]}:{scan_cursor}", "done": False}) + "\n"
+    else:
+        yield json.dumps({"cursor": None, "done": True}) + "\n"
+
+
+class handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if not self.is_authorized():
+            self.send_error_response(401, "Não autorizado")
+            return
+
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        scopes = query.get("scopes", [",".join(EXPORT_SCOPES)])[0].split(",")
+        if any(scope not in EXPORT_SCOPES for scope in scopes):
+            self.send_error_response(400, "Escopo inválido")
+            return
+
+        cursor = query.get("cursor", [None])[0]
+        try:
+            parse_cursor(cursor, scopes)
+        except ValueError as e:
+            self.send_error_response(400, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+
+        deadline = time.monotonic() + EXPORT_TIME_BUDGET
+        for chunk in export_chunks(scopes, cursor, deadline):
+            self.write_chunk(chunk.encode('utf-8'))
+        self.write_chunk(b"")
+
+    def is_authorized(self):
+        if not ADMIN_TOKEN:
+            return False
+        auth = self.headers.get('Authorization', '')
+        return hmac.compare_digest(auth, f"Bearer {ADMIN_TOKEN}")
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_error_response(self, code, message):
+        body = json.dumps({"error": message}).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
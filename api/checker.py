@@ -0,0 +1,231 @@
+"""Verificação periódica dos monitoramentos.
+
+Os monitoramentos de todos os usuários são carregados em uma tabela colunar
+(arrays compactos em vez de uma lista de dicts) e avaliados em passadas
+vetorizadas: um preço por rota, juntado a todos os monitores da rota de uma vez.
+Usa NumPy quando disponível e o módulo `array` caso contrário.
+
+As rotas com alertas viram eventos no stream `events:price`; o envio fica
+com `api/notifier.py`.
+
+As rotas são precificadas em lotes, em ordem, dentro de um tempo máximo por
+execução: cada lote já publica seus eventos, e o cursor (`checker:cursor`)
+guarda a última rota feita para a próxima execução continuar o ciclo.
+"""
+import json
+import math
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from api import quota
+from api.storage import get_storage
+from api.webhook import fetch_prices_for_dates
+
+# Chaves por SCAN/MGET e buscas de preço simultâneas
+SCAN_BATCH = 500
+PRICE_FETCH_WORKERS = 8
+
+NO_PRICE = math.inf
+
+# Tempo máximo por execução para iniciar lotes (cada lote pode levar até o
+# timeout da Travelpayouts) e intervalo entre ciclos completos
+RUN_TIME_BUDGET = 25
+CHECK_INTERVAL = 6 * 3600
+CURSOR_KEY = "checker:cursor"
+IDLE_KEY = "checker:idle"
+
+# Stream de eventos de preço (consumido pelo notifier) e tamanho do histórico
+PRICE_EVENTS_STREAM = "events:price"
+PRICE_EVENTS_MAXLEN = 10000
+
+
+def route_key(monitor):
+    """Identifica a rota consultada (mesma busca serve todos os monitores dela)."""
+    return f"{monitor['origin']}:{monitor['destination']}:{monitor['departure_date']}:{monitor.get('return_date') or ''}"
+
+
+def alert_key(monitor):
+    """Identifica o alerta em `notified:<user_id>` (rota + adultos, pois o preço é total)."""
+    return f"{route_key(monitor)}:{int(monitor.get('adults') or 1)}"
+
+
+def last_notified_price(monitor, notified):
+    """Último preço avisado, guardado fora da lista de monitores.
+
+    A lista (`monitors:<user_id>`) é só do webhook; o notifier grava em
+    `notified:<user_id>` para não sobrescrever exclusões/criações feitas
+    durante a entrega. Monitores antigos ainda podem ter o campo na lista.
+    """
+    return (notified or {}).get(alert_key(monitor), monitor.get("last_notified_price"))
+
+
+class MonitorTable:
+    """Monitoramentos em colunas: uma posição por monitor, rotas por id."""
+
+    def __init__(self):
+        self.routes = []            # id da rota -> chave da rota
+        self.route_ids = array('I')
+        self.thresholds = array('d')
+        self.last_notified = array('d')
+        self.adults = array('B')
+        self.user_ids = array('q')
+        self._route_index = {}
+
+    def __len__(self):
+        return len(self.route_ids)
+
+    def add(self, user_id, monitor, notified=None):
+        key = route_key(monitor)
+        route_id = self._route_index.get(key)
+        if route_id is None:
+            route_id = self._route_index[key] = len(self.routes)
+            self.routes.append(key)
+
+        self.route_ids.append(route_id)
+        self.thresholds.append(monitor.get("max_price") or NO_PRICE)
+        self.last_notified.append(last_notified_price(monitor, notified) or NO_PRICE)
+        self.adults.append(min(int(monitor.get("adults") or 1), 255))
+        self.user_ids.append(int(user_id))
+
+    @classmethod
+    def load(cls, storage=None):
+        """Carrega todos os monitoramentos e últimos avisos (SCAN + MGET em lotes)."""
+        storage = storage or get_storage()
+        table = cls()
+        cursor = "0"
+        while True:
+            cursor, keys = storage.scan(cursor, "monitors:*", SCAN_BATCH)
+            user_ids = [key.split(":", 1)[1] for key in keys]
+            values = storage.mget(keys + [f"notified:{u}" for u in user_ids]) if keys else []
+            for user_id, monitors, notified in zip(user_ids, values[:len(keys)], values[len(keys):]):
+                for monitor in monitors or []:
+                    table.add(user_id, monitor, notified)
+            if cursor == "0":
+                return table
+
+
+def fetch_route_price(key):
+    """Menor preço por pessoa da rota, NO_PRICE sem dados/data passada, ou None sem cota."""
+    origin, destination, departure_date, return_date = key.split(":")
+    if departure_date < datetime.now().strftime("%Y-%m-%d"):
+        return NO_PRICE
+    try:
+        flights = fetch_prices_for_dates(origin, destination, departure_date, return_date or None,
+                                         priority=quota.BACKGROUND)
+    except quota.QuotaExhausted:
+        return None
+    prices = [float(f.get("price", 0)) for f in flights if f.get("price")]
+    return min(prices) if prices else NO_PRICE
+
+
+def fetch_route_prices(routes):
+    """Busca o preço de cada rota distinta (uma chamada por rota).
+
+    Para na primeira rota sem cota: retorna só os preços das rotas anteriores.
+    """
+    with ThreadPoolExecutor(max_workers=PRICE_FETCH_WORKERS) as pool:
+        prices = list(pool.map(fetch_route_price, routes))
+    if None in prices:
+        prices = prices[:prices.index(None)]
+    return array('d', prices)
+
+
+def triggered_alerts(table, route_prices):
+    """Índices dos monitores cujo preço atual pede alerta.
+
+    Alerta quando o preço total (por pessoa x adultos) está abaixo do limite
+    do monitor e abaixo do último preço já notificado.
+    """
+    if np is not None:
+        prices = np.frombuffer(route_prices, dtype=np.float64)[np.frombuffer(table.route_ids, dtype=np.uint32)]
+        totals = prices * np.frombuffer(table.adults, dtype=np.uint8)
+        thresholds = np.frombuffer(table.thresholds, dtype=np.float64)
+        last = np.frombuffer(table.last_notified, dtype=np.float64)
+        mask = np.isfinite(totals) & (totals < thresholds) & (totals < last)
+        return np.flatnonzero(mask).tolist(), totals
+
+    totals = array('d', (route_prices[r] * a for r, a in zip(table.route_ids, table.adults)))
+    hits = [
+        i for i, (total, threshold, last) in enumerate(zip(totals, table.thresholds, table.last_notified))
+        if total < threshold and total < last and total != NO_PRICE
+    ]
+    return hits, totals
+
+
+def publish_price_events(table, hits, route_prices):
+    """Publica um evento por rota com monitores a alertar.
+
+    A entrega (mensagens no Telegram) fica com o notifier, que consome o
+    stream em grupo; aqui só registramos o que foi detectado.
+    """
+    users_by_route = {}
+    for i in hits:
+        users_by_route.setdefault(table.route_ids[i], set()).add(table.user_ids[i])
+
+    storage = get_storage()
+    for route_id, users in users_by_route.items():
+        storage.xadd(PRICE_EVENTS_STREAM, {
+            "route": table.routes[route_id],
+            "price": route_prices[route_id],
+            "users": json.dumps(sorted(users)),
+            "detected_at": datetime.now().isoformat(),
+        }, maxlen=PRICE_EVENTS_MAXLEN)
+    return len(users_by_route)
+
+
+def check_monitors(deadline=None):
+    """Ciclo em lotes: carregar, precificar rotas, avaliar e publicar eventos.
+
+    Retoma do cursor salvo quando a execução anterior parou no tempo limite
+    ou por falta de cota (o cursor fica na última rota de fato precificada).
+    Depois de um ciclo completo, as execuções seguintes não fazem nada até
+    CHECK_INTERVAL (o cron pode rodar com frequência para continuar ciclos).
+    """
+    storage = get_storage()
+    deadline = deadline or time.monotonic() + RUN_TIME_BUDGET
+    cursor, idle = storage.mget([CURSOR_KEY, IDLE_KEY])
+    if idle and not cursor:
+        return {"skipped": True}
+
+    table = MonitorTable.load(storage)
+    route_ids = {key: i for i, key in enumerate(table.routes)}
+    pending = sorted(key for key in table.routes if key > (cursor or ""))
+    route_prices = array('d', [NO_PRICE]) * len(table.routes)
+
+    stats = {"monitors": len(table), "routes": len(table.routes), "priced": 0, "alerts": 0, "events": 0}
+    batch_size = PRICE_FETCH_WORKERS
+    for start in range(0, len(pending), batch_size):
+        # Sempre faz ao menos um lote, para o ciclo nunca ficar parado
+        if start and time.monotonic() >= deadline:
+            break
+        batch = pending[start:start + batch_size]
+        prices = fetch_route_prices(batch)
+        exhausted = len(prices) < len(batch)
+        batch = batch[:len(prices)]
+        for key, price in zip(batch, prices):
+            route_prices[route_ids[key]] = price
+
+        hits, _ = triggered_alerts(table, route_prices)
+        stats["alerts"] += len(hits)
+        stats["events"] += publish_price_events(table, hits, route_prices)
+        stats["priced"] += len(batch)
+        if batch:
+            storage.set(CURSOR_KEY, batch[-1])
+        # Só os preços deste lote participam da próxima avaliação
+        for key in batch:
+            route_prices[route_ids[key]] = NO_PRICE
+        if exhausted:
+            break
+
+    stats["done"] = stats["priced"] == len(pending)
+    if stats["done"]:
+        storage.delete(CURSOR_KEY)
+        storage.set(IDLE_KEY, True, ex=CHECK_INTERVAL)
+    return stats
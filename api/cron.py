@@ -0,0 +1,57 @@
+from http.server import BaseHTTPRequestHandler
+import hmac
+import json
+import os
+import urllib.parse
+from datetime import datetime
+
+from api.checker import check_monitors
+from api.notifier import flush_digests, process_events
+from api.webhook import refresh_alternative_destinations, refresh_stale_prices
+
+# Segredo enviado pelo Vercel Cron no header Authorization
+CRON_SECRET = os.environ.get('CRON_SECRET', '')
+
+# Tarefas periódicas disponíveis (?job=<nome>)
+JOBS = {
+    "alternatives": lambda: {"origins": refresh_alternative_destinations()},
+    "check": check_monitors,
+    "notify": process_events,
+    "digest_hourly": lambda: flush_digests("hourly"),
+    "digest_daily": lambda: flush_digests("daily"),
+    "refresh": lambda: {"refreshed": refresh_stale_prices()},
+}
+
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if not CRON_SECRET or not hmac.compare_digest(
+                self.headers.get('Authorization', ''), f"Bearer {CRON_SECRET}"):
+            self.send_json(401, {"error": "Não autorizado"})
+            return
+
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        job = query.get("job", [""])[0]
+        if job not in JOBS:
+            self.send_json(400, {"error": f"Tarefa desconhecida: {job}"})
+            return
+
+        started = datetime.now()
+        try:
+            result = JOBS[job]()
+        except Exception as e:
+            print(f"Cron {job} error: {e}")
+            self.send_json(500, {"error": "Erro interno"})
+            return
+
+        self.send_json(200, {
+            "job": job,
+            "result": result,
+            "seconds": (datetime.now() - started).total_seconds()
+        })
+
+    def send_json(self, code, data):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(data).encode())
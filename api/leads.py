@@ -1,12 +1,24 @@
 from http.server import BaseHTTPRequestHandler
 import json
+import math
 import urllib.request
 import re
+import time
+import uuid
 from datetime import datetime
 
+from api.storage import get_storage
+
 # URL do Google Sheets (mantida no backend por segurança)
 GOOGLE_SHEETS_URL = "https://script.google.com/macros/s/AKfycbxk5Lir91KwIZ3IRu3J57CmB9UHknyYhdv7gTHApE-jmtT82NPrqCm1wacQFIkZ4pFbEw/exec"
 
+# Limites de taxa (janela deslizante): (máximo de requisições, janela em segundos)
+IP_RATE_LIMITS = [(5, 60), (20, 3600)]
+GLOBAL_RATE_LIMIT = (300, 60)
+
+# Números já salvos recentemente não são reenviados ao Sheets (24 horas)
+SEEN_LEAD_TTL = 24 * 3600
+
 
 def validate_phone(phone):
     """Valida número de telefone brasileiro."""
@@ -16,6 +28,41 @@ def validate_phone(phone):
     return len(digits) >= 10 and len(digits) <= 11
 
 
+def client_ip(handler):
+    """IP do cliente (primeiro endereço do X-Forwarded-For no Vercel)."""
+    forwarded = handler.headers.get('X-Forwarded-For', '')
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return handler.client_address[0] if handler.client_address else "unknown"
+
+
+def check_rate_limit(ip, digits):
+    """Verifica os limites por IP e global em uma única ida ao armazenamento.
+
+    Retorna (segundos para tentar de novo ou 0, se o número já foi salvo).
+    Falhas no armazenamento não bloqueiam o lead.
+    """
+    windows = [(f"ratelimit:leads:ip:{ip}:{seconds}", seconds, limit) for limit, seconds in IP_RATE_LIMITS]
+    windows.append(("ratelimit:leads:global", GLOBAL_RATE_LIMIT[1], GLOBAL_RATE_LIMIT[0]))
+
+    now = time.time()
+    try:
+        counts, (seen,) = get_storage().sliding_window(
+            windows, now, f"{now}:{uuid.uuid4().hex[:8]}", peek_keys=[f"leads:seen:{digits}"])
+    except Exception as e:
+        print(f"Rate limit error: {e}")
+        return 0, False
+
+    # Tentativas recusadas não são registradas; Retry-After espera sair da
+    # janela o acesso que abre espaço para mais um
+    limited, retry_after = False, 0
+    for (count, release), (_, seconds, limit) in zip(counts, windows):
+        if count >= limit:
+            limited = True
+            retry_after = max(retry_after, math.ceil(release + seconds - now))
+    return (max(retry_after, 1) if limited else 0), bool(seen)
+
+
 def save_to_sheets(whatsapp):
     """Salva lead no Google Sheets."""
     try:
@@ -51,10 +98,23 @@ class handler(BaseHTTPRequestHandler):
                 self.send_error_response(400, "Número de WhatsApp inválido")
                 return
 
+            # Limites de taxa e duplicados antes de qualquer chamada externa
+            digits = re.sub(r'\D', '', whatsapp)
+            retry_after, seen = check_rate_limit(client_ip(self), digits)
+            if retry_after:
+                self.send_error_response(429, "Muitas requisições. Tente novamente em instantes.",
+                                         {"Retry-After": str(retry_after)})
+                return
+
+            if seen:
+                self.send_success_response({"message": "Lead salvo com sucesso"})
+                return
+
             # Salvar no Google Sheets
             success = save_to_sheets(whatsapp)
 
             if success:
+                get_storage().set(f"leads:seen:{digits}", True, ex=SEEN_LEAD_TTL)
                 self.send_success_response({"message": "Lead salvo com sucesso"})
             else:
                 self.send_error_response(500, "Erro ao salvar lead")
@@ -83,9 +143,11 @@ class handler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps(data).encode())
 
-    def send_error_response(self, code, message):
+    def send_error_response(self, code, message, headers=None):
         self.send_response(code)
         self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.send_cors_headers()
         self.end_headers()
         self.wfile.write(json.dumps({"error": message}).encode())
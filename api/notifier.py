@@ -0,0 +1,209 @@
+"""Entrega dos alertas de preço.
+
+Consome o stream `events:price` (publicado pelo checker) no grupo
+`notifiers`: cada evento de rota é distribuído aos monitores inscritos, e só
+é confirmado (XACK) depois de todas as mensagens enviadas. Eventos parados
+com um consumidor que morreu são reivindicados e reprocessados; o último
+preço avisado (`notified:<user_id>`, fora da lista de monitores, que só o
+webhook grava) evita alertas duplicados.
+
+Usuários em modo resumo (`prefs:<user_id>`, escolhido no menu do bot) não
+recebem um alerta por mudança: os alertas se acumulam em `digest:<modo>:<chat_id>`
+e viram uma única mensagem por janela (cron `digest_hourly`/`digest_daily`).
+Cada modo tem sua fila: trocar de modo não adianta nem atrasa o que já foi
+acumulado no outro.
+"""
+import json
+import os
+import socket
+import time
+from datetime import datetime
+
+from api.checker import PRICE_EVENTS_STREAM, alert_key, last_notified_price, route_key
+from api.storage import get_storage
+from api.webhook import DIGEST_IMMEDIATE, format_brl, send_message
+
+NOTIFIER_GROUP = "notifiers"
+
+# Eventos por leitura, tempo parado antes de reivindicar e máximo de tentativas
+READ_COUNT = 20
+CLAIM_MIN_IDLE = 300
+MAX_ATTEMPTS = 5
+
+# Tempo máximo por execução (a função serverless tem limite de duração)
+RUN_TIME_BUDGET = 50
+
+# Rotas listadas por resumo (a mensagem do Telegram tem limite de tamanho)
+DIGEST_MAX_ROUTES = 20
+
+
+def consumer_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def alert_text(monitor, total, previous=None):
+    text = (f"*Alerta de preço!*\n\n"
+            f"*{monitor.get('origin_name', monitor['origin'])} → {monitor.get('destination_name', monitor['destination'])}*\n"
+            f"Ida: {monitor['departure_date']}\n")
+    if monitor.get("return_date"):
+        text += f"Volta: {monitor['return_date']}\n"
+    text += f"\nAgora: *{format_brl(total)}*"
+    if previous:
+        text += f" (antes {format_brl(previous)})"
+    return text
+
+
+def prune_notified(notified):
+    """Descarta avisos de viagens que já passaram (a chave traz a data de ida)."""
+    today = datetime.now().strftime("%Y-%m-%d")
+    return {key: price for key, price in notified.items() if key.split(":")[2] >= today}
+
+
+def queue_digest_alert(mode, monitor, total, previous=None):
+    """Acumula o alerta no resumo do chat em vez de enviar agora."""
+    storage = get_storage()
+    storage.rpush(f"digest:{mode}:{monitor['chat_id']}", {
+        "route": route_key(monitor),
+        "origin_name": monitor.get("origin_name", monitor["origin"]),
+        "destination_name": monitor.get("destination_name", monitor["destination"]),
+        "departure_date": monitor["departure_date"],
+        "return_date": monitor.get("return_date"),
+        "adults": int(monitor.get("adults") or 1),
+        "total": total,
+        "previous": previous,
+    })
+    storage.sadd(f"digest:pending:{mode}", monitor["chat_id"])
+
+
+def deliver_event(fields):
+    """Envia (ou acumula no resumo) o alerta do evento a cada monitor inscrito na rota.
+
+    Retorna (entregues, falhas). Monitores já notificados com preço igual ou
+    menor são ignorados, então reprocessar um evento é seguro.
+    """
+    storage = get_storage()
+    route = fields["route"]
+    price = float(fields["price"])
+    users = json.loads(fields["users"])
+
+    n = len(users)
+    values = storage.mget([f"monitors:{u}" for u in users] + [f"prefs:{u}" for u in users] +
+                          [f"notified:{u}" for u in users])
+    sent = failed = 0
+    for user_id, monitors, prefs, notified in zip(users, values[:n], values[n:2 * n], values[2 * n:]):
+        mode = (prefs or {}).get("digest", DIGEST_IMMEDIATE)
+        notified = notified or {}
+        changed = False
+        for monitor in monitors or []:
+            if route_key(monitor) != route:
+                continue
+            total = price * int(monitor.get("adults") or 1)
+            if total >= (monitor.get("max_price") or float("inf")):
+                continue
+            previous = last_notified_price(monitor, notified)
+            if total >= (previous or float("inf")):
+                continue
+            if mode != DIGEST_IMMEDIATE:
+                queue_digest_alert(mode, monitor, total, previous)
+            elif not send_message(monitor["chat_id"], alert_text(monitor, total, previous)):
+                failed += 1
+                continue
+            notified[alert_key(monitor)] = total
+            changed = True
+            sent += 1
+        if changed:
+            storage.set(f"notified:{user_id}", prune_notified(notified))
+    return sent, failed
+
+
+def handle_entries(entries):
+    """Processa eventos entregues ao consumidor; retorna quantos foram confirmados."""
+    storage = get_storage()
+    acked = []
+    for entry_id, fields in entries:
+        try:
+            _, failed = deliver_event(fields)
+        except Exception as e:
+            print(f"Notifier error on {entry_id}: {e}")
+            failed = 1
+
+        if failed:
+            # Fica pendente para nova tentativa, até o limite
+            attempts = storage.incr(f"events:attempts:{entry_id}", ex=86400)
+            # Sem contador (falha no Redis) tenta de novo depois
+            if attempts is None or attempts < MAX_ATTEMPTS:
+                continue
+            print(f"Notifier giving up on {entry_id} after {attempts} attempts")
+        acked.append(entry_id)
+
+    storage.xack(PRICE_EVENTS_STREAM, NOTIFIER_GROUP, *acked)
+    return len(acked)
+
+
+def process_events(consumer=None, deadline=None):
+    """Reivindica eventos parados e consome os novos até esvaziar ou acabar o tempo."""
+    storage = get_storage()
+    consumer = consumer or consumer_name()
+    deadline = deadline or time.monotonic() + RUN_TIME_BUDGET
+    storage.xgroup_create(PRICE_EVENTS_STREAM, NOTIFIER_GROUP)
+
+    stats = {"claimed": 0, "read": 0, "acked": 0}
+    claimed = storage.xautoclaim(PRICE_EVENTS_STREAM, NOTIFIER_GROUP, consumer, CLAIM_MIN_IDLE, READ_COUNT)
+    stats["claimed"] = len(claimed)
+    stats["acked"] += handle_entries(claimed)
+
+    while time.monotonic() < deadline:
+        entries = storage.xreadgroup(PRICE_EVENTS_STREAM, NOTIFIER_GROUP, consumer, READ_COUNT)
+        if not entries:
+            break
+        stats["read"] += len(entries)
+        stats["acked"] += handle_entries(entries)
+    return stats
+
+
+def digest_text(items):
+    """Junta os alertas acumulados em uma mensagem: um item por rota, preço mais recente."""
+    routes = {}
+    for item in items:
+        key = (item["route"], item["adults"])
+        if key in routes:
+            # Mantém o preço anterior do primeiro alerta e o atual do último
+            routes[key]["total"] = item["total"]
+        else:
+            routes[key] = dict(item)
+
+    text = f"*Resumo de alertas* ({len(routes)} rota(s))\n\n"
+    for item in sorted(routes.values(), key=lambda i: i["total"])[:DIGEST_MAX_ROUTES]:
+        text += f"*{item['origin_name']} → {item['destination_name']}*\n"
+        text += f"   Ida: {item['departure_date']}"
+        if item.get("return_date"):
+            text += f" | Volta: {item['return_date']}"
+        text += f"\n   Agora: *{format_brl(item['total'])}*"
+        if item.get("previous"):
+            text += f" (antes {format_brl(item['previous'])})"
+        text += "\n\n"
+    if len(routes) > DIGEST_MAX_ROUTES:
+        text += f"_+{len(routes) - DIGEST_MAX_ROUTES} outra(s) rota(s) com preço menor_"
+    return text.rstrip()
+
+
+def flush_digests(mode):
+    """Envia uma mensagem por chat com os alertas acumulados no modo (hourly/daily)."""
+    storage = get_storage()
+    pending_key = f"digest:pending:{mode}"
+    stats = {"chats": 0, "alerts": 0, "failed": 0}
+    for chat_id in storage.smembers(pending_key):
+        # Sai do índice antes de ler: alertas novos durante o envio o recolocam
+        storage.srem(pending_key, chat_id)
+        items = storage.lrange(f"digest:{mode}:{chat_id}")
+        if not items:
+            continue
+        if not send_message(chat_id, digest_text(items)):
+            storage.sadd(pending_key, chat_id)
+            stats["failed"] += 1
+            continue
+        # Remove só os itens enviados; os que chegaram depois ficam para a próxima janela
+        storage.lpop(f"digest:{mode}:{chat_id}", len(items))
+        stats["chats"] += 1
+        stats["alerts"] += len(items)
+    return stats
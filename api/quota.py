@@ -0,0 +1,105 @@
+"""Orçamento de chamadas à API da Travelpayouts.
+
+Conta as chamadas por janela de tempo no armazenamento e reserva parte da
+cota para buscas interativas (usuário esperando no chat) em relação às
+verificações em segundo plano (cron). As respostas ficam em cache: perto do
+limite, o bot responde com o preço em cache (com a idade) e agenda a
+atualização para o cron em vez de gastar cota na hora.
+"""
+import hashlib
+import json
+import os
+import time
+import urllib.parse
+
+from api.storage import get_storage
+
+# Cota da Travelpayouts: chamadas por janela (segundos)
+QUOTA_LIMIT = int(os.environ.get('TRAVELPAYOUTS_QUOTA_LIMIT', '600'))
+QUOTA_WINDOW = int(os.environ.get('TRAVELPAYOUTS_QUOTA_WINDOW', '3600'))
+
+# Parte da cota que só buscas interativas podem usar
+INTERACTIVE_RESERVE = 0.3
+# A partir desta fração da cota, respostas em cache são servidas mesmo velhas
+NEAR_LIMIT = 0.8
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# Cache das respostas: frescas por 30 minutos, guardadas por 1 dia
+FRESH_TTL = 30 * 60
+STALE_TTL = 24 * 3600
+
+# Consultas a atualizar pelo cron (conjunto: cada consulta aparece uma vez)
+REFRESH_QUEUE = "tpcache:refresh"
+
+
+class QuotaExhausted(Exception):
+    """A parte da cota do segundo plano acabou (o cron deve parar e retomar depois)."""
+
+
+def window_key(now=None):
+    return f"quota:travelpayouts:{int((now or time.time()) // QUOTA_WINDOW)}"
+
+
+def cache_key(path, params):
+    """Chave do cache para a consulta (parâmetros sem o token)."""
+    query = urllib.parse.urlencode(sorted(params.items()))
+    return f"tpcache:{hashlib.sha1(f'{path}?{query}'.encode()).hexdigest()}"
+
+
+def lookup(path, params):
+    """Lê a resposta em cache e o uso atual da cota em uma única ida."""
+    try:
+        entry, used = get_storage().mget([cache_key(path, params), window_key()])
+    except IOError:
+        # Sem o Redis a busca segue direto para a API
+        return None, 0
+    return entry, int(used or 0)
+
+
+def allowed(priority, used):
+    limit = QUOTA_LIMIT if priority == INTERACTIVE else QUOTA_LIMIT * (1 - INTERACTIVE_RESERVE)
+    return used < limit
+
+
+def near_limit(used):
+    return used >= QUOTA_LIMIT * NEAR_LIMIT
+
+
+def acquire(priority, used=None):
+    """Reserva uma chamada na janela atual; False se a prioridade já esgotou sua parte.
+
+    Chamadas recusadas não contam: o cron que bate no limite dele não consome
+    a reserva das buscas interativas. `used` evita reler o contador quando o
+    chamador já o tem (ver `lookup`).
+    """
+    storage = get_storage()
+    if used is None:
+        used = int(storage.get(window_key()) or 0)
+    if not allowed(priority, used):
+        return False
+    count = storage.incr(window_key(), ex=QUOTA_WINDOW)
+    # Sem armazenamento não há como contar: não bloqueia
+    return count is None or allowed(priority, count - 1)
+
+
+def store(path, params, data):
+    """Guarda a resposta no cache e retorna o momento da consulta."""
+    fetched_at = int(time.time())
+    get_storage().set(cache_key(path, params), {"at": fetched_at, "data": data}, ex=STALE_TTL)
+    return fetched_at
+
+
+def schedule_refresh(path, params):
+    """Agenda a atualização de uma resposta velha para o cron (prioridade baixa)."""
+    get_storage().sadd(REFRESH_QUEUE, json.dumps({"path": path, "params": params}, sort_keys=True))
+
+
+def pending_refreshes(count):
+    """Retira até `count` consultas agendadas."""
+    storage = get_storage()
+    members = storage.smembers(REFRESH_QUEUE)[:count]
+    if members:
+        storage.srem(REFRESH_QUEUE, *members)
+    return [json.loads(member) for member in members]
@@ -0,0 +1,653 @@
+"""Camada de armazenamento do bot.
+
+Toda a persistência (sessões, monitoramentos, índices, caches e filas) passa
+por um `Storage`. Três implementações estão disponíveis:
+
+- `UpstashStorage`: Upstash Redis via REST (padrão em produção no Vercel)
+- `SQLiteStorage`: arquivo SQLite local em modo WAL (servidor próprio)
+- `MemoryStorage`: dicionário em memória (testes e desenvolvimento offline)
+
+A escolha é feita pela variável `STORAGE_BACKEND` (upstash, sqlite, memory).
+Os valores são serializados em JSON pela própria camada.
+"""
+import fnmatch
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'upstash')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'monitor.db')
+
+# Timeout padrão para requisições HTTP (10 segundos)
+HTTP_TIMEOUT = 10
+
+# Janelas deslizantes em uma ida: limpa e conta cada janela e só registra o
+# acesso se ele couber em todas (recusados não ocupam espaço em nenhuma).
+# KEYS: janelas; ARGV: agora, membro, depois (segundos, limite) por janela.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local result, allowed = {}, true
+for i, key in ipairs(KEYS) do
+  local seconds, limit = tonumber(ARGV[i * 2 + 1]), tonumber(ARGV[i * 2 + 2])
+  redis.call('ZREMRANGEBYSCORE', key, '-inf', now - seconds)
+  local count = redis.call('ZCARD', key)
+  local release = redis.call('ZRANGE', key, -limit, -limit, 'WITHSCORES')[2] or ARGV[1]
+  if count >= limit then allowed = false end
+  result[i] = {count, release}
+end
+if allowed then
+  for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, ARGV[1], ARGV[2])
+    redis.call('EXPIRE', key, tonumber(ARGV[i * 2 + 1]) + 1)
+  end
+end
+return result
+"""
+
+
+def decode_value(raw):
+    """Converte o valor bruto armazenado em JSON quando possível."""
+    if raw is None:
+        return None
+    try:
+        return json.loads(raw)
+    except (TypeError, json.JSONDecodeError):
+        return raw
+
+
+class Storage:
+    """Interface comum dos backends de armazenamento."""
+
+    # Chave/valor
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ex=None):
+        raise NotImplementedError
+
+    def mget(self, keys):
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+    def expire(self, key, seconds):
+        raise NotImplementedError
+
+    def incr(self, key, ex=None):
+        raise NotImplementedError
+
+    # Índices (conjuntos)
+
+    def sadd(self, key, *members):
+        raise NotImplementedError
+
+    def srem(self, key, *members):
+        raise NotImplementedError
+
+    def smembers(self, key):
+        raise NotImplementedError
+
+    # Filas (listas)
+
+    def rpush(self, key, *values):
+        raise NotImplementedError
+
+    def lpop(self, key, count=1):
+        raise NotImplementedError
+
+    def lrange(self, key, start=0, stop=-1):
+        raise NotImplementedError
+
+    # Streams (eventos com grupos de consumidores)
+
+    def xadd(self, stream, fields, maxlen=None):
+        """Publica um evento (dict de strings) e retorna o id."""
+        raise NotImplementedError
+
+    def xgroup_create(self, stream, group):
+        """Cria o grupo (e o stream) se ainda não existir."""
+        raise NotImplementedError
+
+    def xreadgroup(self, stream, group, consumer, count=10):
+        """Entrega ao consumidor eventos novos do grupo: [(id, fields)]."""
+        raise NotImplementedError
+
+    def xack(self, stream, group, *ids):
+        raise NotImplementedError
+
+    def xautoclaim(self, stream, group, consumer, min_idle_seconds, count=10):
+        """Toma para o consumidor eventos pendentes parados há mais de min_idle_seconds."""
+        raise NotImplementedError
+
+    def xrange(self, stream, start="-", end="+", count=100):
+        """Histórico do stream (para reprocessar ou depurar)."""
+        raise NotImplementedError
+
+    # Janelas deslizantes (limites de taxa)
+
+    def sliding_window(self, windows, now, member, peek_keys=()):
+        """Registra o acesso se couber em todas as janelas e lê chaves extras na mesma ida.
+
+        windows: lista de (chave, segundos, limite). Retorna ([(contagem, libera_em)], [valores de peek_keys]),
+        com a contagem antes do acesso; a janela está cheia quando contagem >= limite.
+        Um acesso recusado não é registrado em nenhuma janela (um IP bloqueado não
+        ocupa a janela global). libera_em é o momento do acesso cuja saída da
+        janela deixa espaço para mais um (o `limite`-ésimo mais recente).
+        """
+        raise NotImplementedError
+
+    # Varredura
+
+    def scan(self, cursor, match="*", count=100):
+        """Retorna (próximo cursor, chaves); cursor "0" indica o fim.
+
+        O cursor é opaco: número do SCAN no Redis, última chave devolvida nos
+        backends locais.
+        """
+        raise NotImplementedError
+
+
+class UpstashStorage(Storage):
+    """Upstash Redis via API REST."""
+
+    def __init__(self, url, token):
+        self.url = url
+        self.token = token
+
+    def request(self, url, data=None):
+        req = urllib.request.Request(
+            url,
+            data=data,
+            headers={"Authorization": f"Bearer {self.token}"}
+        )
+        with urllib.request.urlopen(req, timeout=HTTP_TIMEOUT) as response:
+            return json.loads(response.read().decode())
+
+    def command(self, *args):
+        """Executa um comando Redis arbitrário."""
+        if not self.url:
+            return None
+        try:
+            body = json.dumps([str(a) for a in args]).encode('utf-8')
+            return self.request(self.url, body).get('result')
+        except (urllib.error.URLError, json.JSONDecodeError) as e:
+            print(f"Redis {args[0] if args else ''} error: {e}")
+            return None
+
+    def pipeline(self, commands):
+        """Executa vários comandos Redis em uma única requisição.
+
+        Falha de comunicação levanta IOError (como no scan): resultados
+        vazios seriam confundidos com chaves inexistentes.
+        """
+        if not self.url or not commands:
+            return [None] * len(commands)
+        try:
+            body = json.dumps([[str(a) for a in cmd] for cmd in commands]).encode('utf-8')
+            return [item.get('result') for item in self.request(f"{self.url}/pipeline", body)]
+        except (urllib.error.URLError, json.JSONDecodeError) as e:
+            print(f"Redis pipeline error: {e}")
+            raise IOError("Falha ao consultar o Redis") from e
+
+    def get(self, key):
+        if not self.url:
+            return None
+        try:
+            return decode_value(self.request(f"{self.url}/get/{key}").get('result'))
+        except urllib.error.URLError as e:
+            print(f"Redis GET error: {e}")
+            return None
+        except json.JSONDecodeError as e:
+            print(f"Redis JSON error: {e}")
+            return None
+
+    def set(self, key, value, ex=None):
+        if not self.url:
+            return False
+        try:
+            encoded_value = urllib.parse.quote(json.dumps(value), safe='')
+            url = f"{self.url}/set/{key}/{encoded_value}"
+            if ex:
+                url += f"/EX/{int(ex)}"
+            self.request(url)
+            return True
+        except (urllib.error.URLError, json.JSONDecodeError) as e:
+            print(f"Redis SET error: {e}")
+            return False
+
+    def mget(self, keys):
+        if not keys:
+            return []
+        if not self.url:
+            return [None] * len(keys)
+        values = self.command("MGET", *keys)
+        if values is None:
+            raise IOError("Falha ao consultar o Redis")
+        return [decode_value(v) for v in values]
+
+    def delete(self, *keys):
+        return self.command("DEL", *keys) or 0
+
+    def expire(self, key, seconds):
+        return bool(self.command("EXPIRE", key, int(seconds)))
+
+    def incr(self, key, ex=None):
+        if not ex:
+            return self.command("INCR", key)
+        try:
+            value, _ = self.pipeline([["INCR", key], ["EXPIRE", key, int(ex), "NX"]])
+        except IOError:
+            return None
+        return value
+
+    def sadd(self, key, *members):
+        return self.command("SADD", key, *members) or 0
+
+    def srem(self, key, *members):
+        return self.command("SREM", key, *members) or 0
+
+    def smembers(self, key):
+        return self.command("SMEMBERS", key) or []
+
+    def rpush(self, key, *values):
+        return self.command("RPUSH", key, *[json.dumps(v) for v in values]) or 0
+
+    def lpop(self, key, count=1):
+        values = self.command("LPOP", key, count) or []
+        return [decode_value(v) for v in values]
+
+    def lrange(self, key, start=0, stop=-1):
+        return [decode_value(v) for v in self.command("LRANGE", key, start, stop) or []]
+
+    @staticmethod
+    def parse_entries(entries):
+        return [(entry_id, dict(zip(values[::2], values[1::2]))) for entry_id, values in entries or []]
+
+    def xadd(self, stream, fields, maxlen=None):
+        trim = ["MAXLEN", "~", maxlen] if maxlen else []
+        args = [item for pair in fields.items() for item in pair]
+        return self.command("XADD", stream, *trim, "*", *args)
+
+    def xgroup_create(self, stream, group):
+        # BUSYGROUP (grupo já existe) volta como erro e é ignorado
+        self.pipeline([["XGROUP", "CREATE", stream, group, "0", "MKSTREAM"]])
+
+    def xreadgroup(self, stream, group, consumer, count=10):
+        result = self.command("XREADGROUP", "GROUP", group, consumer, "COUNT", count, "STREAMS", stream, ">")
+        return self.parse_entries(result[0][1]) if result else []
+
+    def xack(self, stream, group, *ids):
+        if not ids:
+            return 0
+        return self.command("XACK", stream, group, *ids) or 0
+
+    def xautoclaim(self, stream, group, consumer, min_idle_seconds, count=10):
+        result = self.command("XAUTOCLAIM", stream, group, consumer, int(min_idle_seconds * 1000), "0", "COUNT", count)
+        return self.parse_entries(result[1]) if result else []
+
+    def xrange(self, stream, start="-", end="+", count=100):
+        return self.parse_entries(self.command("XRANGE", stream, start, end, "COUNT", count))
+
+    def sliding_window(self, windows, now, member, peek_keys=()):
+        args = [len(windows)] + [key for key, _, _ in windows] + [now, member]
+        for _, seconds, limit in windows:
+            args += [int(seconds), limit]
+        results = self.pipeline([["EVAL", SLIDING_WINDOW_SCRIPT] + args] + [["GET", key] for key in peek_keys])
+        counts = [(int(count), float(release)) for count, release in results[0] or []]
+        return counts or [(0, now)] * len(windows), [decode_value(v) for v in results[1:]]
+
+    def scan(self, cursor, match="*", count=100):
+        result = self.command("SCAN", cursor, "MATCH", match, "COUNT", count)
+        if result is None:
+            raise IOError("Falha ao consultar o Redis")
+        return str(result[0]), result[1]
+
+
+class LocalStorage(Storage):
+    """Operações comuns aos backends locais.
+
+    Cada chave guarda (tipo, valor, expira_em); as subclasses só precisam
+    implementar a leitura/escrita de uma entrada e a listagem de chaves.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+
+    def load(self, key):
+        raise NotImplementedError
+
+    def save(self, key, kind, value, expires_at):
+        raise NotImplementedError
+
+    def remove(self, key):
+        raise NotImplementedError
+
+    def keys(self):
+        raise NotImplementedError
+
+    def keys_after(self, after, match, count):
+        """Até `count` chaves vivas depois de `after` (em ordem), que casam com `match`."""
+        batch = []
+        for key in sorted(k for k in self.keys() if k > after and fnmatch.fnmatchcase(k, match)):
+            if self.exists(key):
+                batch.append(key)
+                if len(batch) == count:
+                    break
+        return batch
+
+    def entry(self, key, kind=None):
+        """Retorna (valor, expira_em) da chave, descartando entradas vencidas."""
+        found = self.load(key)
+        if found is None:
+            return None, None
+        found_kind, value, expires_at = found
+        if expires_at is not None and expires_at <= time.time():
+            self.remove(key)
+            return None, None
+        if kind and found_kind != kind:
+            raise TypeError(f"WRONGTYPE {key} guarda {found_kind}")
+        return value, expires_at
+
+    def exists(self, key):
+        """Se a chave existe e não venceu (um valor JSON null também conta)."""
+        found = self.load(key)
+        if found is None:
+            return False
+        if found[2] is not None and found[2] <= time.time():
+            self.remove(key)
+            return False
+        return True
+
+    def get(self, key):
+        with self.lock:
+            try:
+                return self.entry(key, "string")[0]
+            except TypeError:
+                return None
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self.save(key, "string", value, time.time() + ex if ex else None)
+            return True
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def delete(self, *keys):
+        with self.lock:
+            removed = 0
+            for key in keys:
+                if self.exists(key):
+                    self.remove(key)
+                    removed += 1
+            return removed
+
+    def expire(self, key, seconds):
+        with self.lock:
+            found = self.load(key)
+            if found is None:
+                return False
+            self.save(key, found[0], found[1], time.time() + seconds)
+            return True
+
+    def incr(self, key, ex=None):
+        with self.lock:
+            value, expires_at = self.entry(key, "string")
+            if expires_at is None and ex:
+                expires_at = time.time() + ex
+            value = int(value or 0) + 1
+            self.save(key, "string", value, expires_at)
+            return value
+
+    def sadd(self, key, *members):
+        with self.lock:
+            current, expires_at = self.entry(key, "set")
+            current = list(current or [])
+            added = [m for m in dict.fromkeys(str(m) for m in members) if m not in current]
+            self.save(key, "set", current + added, expires_at)
+            return len(added)
+
+    def srem(self, key, *members):
+        with self.lock:
+            current, expires_at = self.entry(key, "set")
+            if not current:
+                return 0
+            members = {str(m) for m in members}
+            remaining = [m for m in current if m not in members]
+            if remaining:
+                self.save(key, "set", remaining, expires_at)
+            else:
+                self.remove(key)
+            return len(current) - len(remaining)
+
+    def smembers(self, key):
+        with self.lock:
+            return list(self.entry(key, "set")[0] or [])
+
+    def rpush(self, key, *values):
+        with self.lock:
+            current, expires_at = self.entry(key, "list")
+            current = list(current or []) + list(values)
+            self.save(key, "list", current, expires_at)
+            return len(current)
+
+    def lpop(self, key, count=1):
+        with self.lock:
+            current, expires_at = self.entry(key, "list")
+            if not current:
+                return []
+            popped, remaining = current[:count], current[count:]
+            if remaining:
+                self.save(key, "list", remaining, expires_at)
+            else:
+                self.remove(key)
+            return popped
+
+    def lrange(self, key, start=0, stop=-1):
+        with self.lock:
+            current = self.entry(key, "list")[0] or []
+            return current[start:None if stop == -1 else stop + 1]
+
+    def stream(self, stream):
+        return self.entry(stream, "stream")[0] or {"seq": 0, "entries": [], "groups": {}}
+
+    @staticmethod
+    def stream_id_key(entry_id):
+        millis, seq = entry_id.split("-")
+        return int(millis), int(seq)
+
+    def xadd(self, stream, fields, maxlen=None):
+        with self.lock:
+            data = self.stream(stream)
+            data["seq"] += 1
+            entry_id = f"{int(time.time() * 1000)}-{data['seq']}"
+            data["entries"].append([entry_id, {k: str(v) for k, v in fields.items()}])
+            if maxlen and len(data["entries"]) > maxlen:
+                data["entries"] = data["entries"][-maxlen:]
+            self.save(stream, "stream", data, None)
+            return entry_id
+
+    def xgroup_create(self, stream, group):
+        with self.lock:
+            data = self.stream(stream)
+            data["groups"].setdefault(group, {"last": "0-0", "pending": {}})
+            self.save(stream, "stream", data, None)
+
+    def xreadgroup(self, stream, group, consumer, count=10):
+        with self.lock:
+            data = self.stream(stream)
+            state = data["groups"][group]
+            last = self.stream_id_key(state["last"])
+            delivered = [e for e in data["entries"] if self.stream_id_key(e[0]) > last][:count]
+            for entry_id, _ in delivered:
+                state["pending"][entry_id] = [consumer, time.time()]
+            if delivered:
+                state["last"] = delivered[-1][0]
+                self.save(stream, "stream", data, None)
+            return [(entry_id, fields) for entry_id, fields in delivered]
+
+    def xack(self, stream, group, *ids):
+        with self.lock:
+            data = self.stream(stream)
+            pending = data["groups"].get(group, {}).get("pending", {})
+            acked = sum(1 for entry_id in ids if pending.pop(entry_id, None) is not None)
+            self.save(stream, "stream", data, None)
+            return acked
+
+    def xautoclaim(self, stream, group, consumer, min_idle_seconds, count=10):
+        with self.lock:
+            data = self.stream(stream)
+            pending = data["groups"][group]["pending"]
+            entries = dict((entry_id, fields) for entry_id, fields in data["entries"])
+            now = time.time()
+            claimed = []
+            for entry_id in sorted(pending, key=self.stream_id_key):
+                if len(claimed) >= count:
+                    break
+                if now - pending[entry_id][1] < min_idle_seconds:
+                    continue
+                if entry_id not in entries:
+                    # Evento removido pelo MAXLEN: não há o que reprocessar
+                    pending.pop(entry_id)
+                    continue
+                pending[entry_id] = [consumer, now]
+                claimed.append((entry_id, entries[entry_id]))
+            self.save(stream, "stream", data, None)
+            return claimed
+
+    def xrange(self, stream, start="-", end="+", count=100):
+        with self.lock:
+            low = (0, 0) if start == "-" else self.stream_id_key(start)
+            high = None if end == "+" else self.stream_id_key(end)
+            return [
+                (entry_id, fields) for entry_id, fields in self.stream(stream)["entries"]
+                if self.stream_id_key(entry_id) >= low and (high is None or self.stream_id_key(entry_id) <= high)
+            ][:count]
+
+    def sliding_window(self, windows, now, member, peek_keys=()):
+        with self.lock:
+            counts, live = [], []
+            for key, seconds, limit in windows:
+                entries = [e for e in (self.entry(key, "zset")[0] or []) if e[0] > now - seconds]
+                scores = sorted(e[0] for e in entries)
+                counts.append((len(entries), scores[-limit] if len(scores) >= limit else now))
+                live.append(entries)
+            if all(count < limit for (count, _), (_, _, limit) in zip(counts, windows)):
+                for (key, seconds, _), entries in zip(windows, live):
+                    self.save(key, "zset", entries + [[now, member]], now + seconds + 1)
+            return counts, [self.get(key) for key in peek_keys]
+
+    def scan(self, cursor, match="*", count=100):
+        # Pagina pela chave: apagar chaves entre as páginas não pula as restantes
+        with self.lock:
+            batch = self.keys_after("" if cursor == "0" else cursor, match, count)
+            return (batch[-1] if len(batch) == count else "0"), batch
+
+
+class MemoryStorage(LocalStorage):
+    """Armazenamento em memória (perde os dados ao reiniciar)."""
+
+    def __init__(self):
+        super().__init__()
+        self.data = {}
+
+    def load(self, key):
+        found = self.data.get(key)
+        if found is None:
+            return None
+        return found[0], json.loads(found[1]), found[2]
+
+    def save(self, key, kind, value, expires_at):
+        # Guarda serializado para que o chamador não altere o valor armazenado
+        self.data[key] = (kind, json.dumps(value), expires_at)
+
+    def remove(self, key):
+        self.data.pop(key, None)
+
+    def keys(self):
+        return list(self.data)
+
+
+class SQLiteStorage(LocalStorage):
+    """Armazenamento em arquivo SQLite (modo WAL) para servidor próprio."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " key TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL)"
+        )
+
+    def load(self, key):
+        row = self.conn.execute("SELECT kind, value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    def save(self, key, kind, value, expires_at):
+        self.conn.execute(
+            "INSERT INTO kv (key, kind, value, expires_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET kind = excluded.kind, value = excluded.value,"
+            " expires_at = excluded.expires_at",
+            (key, kind, json.dumps(value), expires_at)
+        )
+
+    def remove(self, key):
+        self.conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def keys(self):
+        return [row[0] for row in self.conn.execute("SELECT key FROM kv")]
+
+    def keys_after(self, after, match, count):
+        # Usa o índice da chave primária: memória constante por página
+        rows = self.conn.execute(
+            "SELECT key FROM kv WHERE key > ? AND key GLOB ? AND (expires_at IS NULL OR expires_at > ?)"
+            " ORDER BY key LIMIT ?",
+            (after, match, time.time(), count)
+        )
+        return [row[0] for row in rows]
+
+
+_storage = None
+
+
+def create_storage(backend=None):
+    """Cria o backend configurado."""
+    backend = backend or STORAGE_BACKEND
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteStorage(SQLITE_PATH)
+    if backend == "upstash":
+        return UpstashStorage(
+            os.environ.get('UPSTASH_REDIS_REST_URL', ''),
+            os.environ.get('UPSTASH_REDIS_REST_TOKEN', '')
+        )
+    raise ValueError(f"STORAGE_BACKEND desconhecido: {backend}")
+
+
+def get_storage():
+    """Retorna o backend em uso (criado na primeira chamada)."""
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
+
+
+def set_storage(storage):
+    """Troca o backend em uso (testes e servidor próprio)."""
+    global _storage
+    _storage = storage
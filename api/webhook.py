@@ -1,14 +1,23 @@
 from http.server import BaseHTTPRequestHandler
+import base64
+import hashlib
+import hmac
 import json
 import os
+import struct
 import urllib.request
 import urllib.parse
-from datetime import datetime
+import heapq
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from api import quota
+from api.storage import get_storage
 
 # Configurações
 TELEGRAM_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
-UPSTASH_URL = os.environ.get('UPSTASH_REDIS_REST_URL', '')
-UPSTASH_TOKEN = os.environ.get('UPSTASH_REDIS_REST_TOKEN', '')
 
 # Travelpayouts API
 TRAVELPAYOUTS_TOKEN = os.environ.get('TRAVELPAYOUTS_TOKEN', '')
@@ -17,6 +26,38 @@ TRAVELPAYOUTS_BASE_URL = 'https://api.travelpayouts.com'
 # Timeout padrão para requisições HTTP (10 segundos)
 HTTP_TIMEOUT = 10
 
+# Respostas velhas da Travelpayouts atualizadas por execução do cron
+REFRESH_BATCH = 50
+
+# Resultados de busca guardados para paginação (15 minutos, 5 por página)
+SEARCH_RESULTS_LIMIT = 30
+RESULTS_TTL = 900
+RESULTS_PAGE_SIZE = 5
+
+# Ida+volta montada com dois trechos só ida: aceitar voltar de outro aeroporto
+# da mesma cidade (open-jaw) e limite de pares visitados por resultado pedido
+ROUND_TRIP_OPEN_JAW = os.environ.get('ROUND_TRIP_OPEN_JAW', '1') == '1'
+LEG_PAIRS_SCAN_FACTOR = 20
+
+# Segredo que assina o estado guardado nos botões (padrão: token do bot)
+CALLBACK_SECRET = os.environ.get('CALLBACK_SECRET', '')
+
+# Datas aceitas até 1 ano à frente (as companhias não vendem além disso; as
+# datas também precisam caber nos 16 bits do token dos botões)
+MAX_DAYS_AHEAD = 365
+
+# Frequência dos alertas por usuário (prefs:<user_id>): imediato ou resumo
+DIGEST_IMMEDIATE = "immediate"
+DIGEST_MODES = {
+    DIGEST_IMMEDIATE: "Imediato (um alerta por mudança)",
+    "hourly": "Resumo a cada hora",
+    "daily": "Resumo diário",
+}
+
+# Tabela de destinos alternativos por origem (atualizada pelo cron diário)
+ALTERNATIVES_PER_ORIGIN = 6
+ALTERNATIVES_TTL = 3 * 24 * 3600
+
 # Base de aeroportos brasileiros (fallback para API de teste limitada)
 BRAZILIAN_AIRPORTS = [
     {"code": "GRU", "name": "Aeroporto de Guarulhos", "city": "São Paulo"},
@@ -88,6 +129,7 @@ INTERNATIONAL_AIRPORTS = [
 ]
 
 ALL_AIRPORTS = BRAZILIAN_AIRPORTS + INTERNATIONAL_AIRPORTS
+AIRPORTS_BY_CODE = {a["code"]: a for a in ALL_AIRPORTS}
 
 
 def normalize_text(text):
@@ -127,44 +169,45 @@ def search_local_airports(keyword):
 
 
 def redis_get(key):
-    """Busca valor no Redis."""
-    if not UPSTASH_URL:
-        return None
-    try:
-        url = f"{UPSTASH_URL}/get/{key}"
-        req = urllib.request.Request(url, headers={"Authorization": f"Bearer {UPSTASH_TOKEN}"})
-        with urllib.request.urlopen(req, timeout=HTTP_TIMEOUT) as response:
-            data = json.loads(response.read().decode())
-            result = data.get('result')
-            return json.loads(result) if result else None
-    except urllib.error.URLError as e:
-        print(f"Redis GET error: {e}")
-        return None
-    except json.JSONDecodeError as e:
-        print(f"Redis JSON error: {e}")
-        return None
+    """Busca valor no armazenamento."""
+    return get_storage().get(key)
 
 
-def redis_set(key, value):
-    """Salva valor no Redis."""
-    if not UPSTASH_URL:
-        return False
+def redis_set(key, value, ex=None):
+    """Salva valor no armazenamento."""
+    return get_storage().set(key, value, ex=ex)
+
+
+def send_message(chat_id, text, reply_markup=None):
+    """Envia mensagem via Telegram."""
+    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+    data = {
+        "chat_id": chat_id,
+        "text": text,
+        "parse_mode": "Markdown"
+    }
+    if reply_markup:
+        data["reply_markup"] = json.dumps(reply_markup)
+
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(data).encode('utf-8'),
+        headers={"Content-Type": "application/json"}
+    )
     try:
-        encoded_value = urllib.parse.quote(json.dumps(value))
-        url = f"{UPSTASH_URL}/set/{key}/{encoded_value}"
-        req = urllib.request.Request(url, headers={"Authorization": f"Bearer {UPSTASH_TOKEN}"})
         urllib.request.urlopen(req, timeout=HTTP_TIMEOUT)
         return True
     except urllib.error.URLError as e:
-        print(f"Redis SET error: {e}")
+        print(f"Telegram send error: {e}")
         return False
 
 
-def send_message(chat_id, text, reply_markup=None):
-    """Envia mensagem via Telegram."""
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+def edit_message(chat_id, message_id, text, reply_markup=None):
+    """Edita uma mensagem já enviada (ex: paginação de resultados)."""
+    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/editMessageText"
     data = {
         "chat_id": chat_id,
+        "message_id": message_id,
         "text": text,
         "parse_mode": "Markdown"
     }
@@ -180,7 +223,7 @@ def send_message(chat_id, text, reply_markup=None):
         urllib.request.urlopen(req, timeout=HTTP_TIMEOUT)
         return True
     except urllib.error.URLError as e:
-        print(f"Telegram send error: {e}")
+        print(f"Telegram edit error: {e}")
         return False
 
 
@@ -220,51 +263,201 @@ def search_flights(origin, destination, departure_date, return_date=None, adults
     return offers
 
 
-def search_flights_by_date(origin, destination, departure_date, return_date=None, adults=1):
-    """Busca voos por data específica."""
+def request_travelpayouts(path, params, timeout=30):
+    """Consulta a Travelpayouts e guarda a resposta no cache.
+
+    Retorna (resposta, momento da consulta), ou (None, None) em caso de erro.
+    """
+    query_string = urllib.parse.urlencode({**params, "token": TRAVELPAYOUTS_TOKEN})
+    url = f"{TRAVELPAYOUTS_BASE_URL}{path}?{query_string}"
+
+    try:
+        req = urllib.request.Request(url)
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            data = json.loads(response.read().decode())
+    except (urllib.error.URLError, json.JSONDecodeError) as e:
+        print(f"Travelpayouts {path} error: {e}")
+        return None, None
+
+    if not data.get("success"):
+        return data, int(time.time())
+    return data, quota.store(path, params, data)
+
+
+def travelpayouts_get(path, params, priority=quota.INTERACTIVE, timeout=30):
+    """GET na Travelpayouts respeitando a cota de chamadas.
+
+    Retorna (resposta, momento da consulta), ou (None, None) sem dados.
+    Resposta fresca em cache é usada direto; perto do limite da cota a
+    resposta velha é servida e a atualização fica agendada para o cron.
+    Em segundo plano, cota esgotada sem cache levanta quota.QuotaExhausted:
+    o cron precisa distinguir "sem cota" de "sem voos" para retomar depois.
+    """
+    entry, used = quota.lookup(path, params)
+    if entry and time.time() - entry["at"] < quota.FRESH_TTL:
+        return entry["data"], entry["at"]
+    if entry and quota.near_limit(used):
+        quota.schedule_refresh(path, params)
+        return entry["data"], entry["at"]
+
+    if not quota.acquire(priority, used):
+        print(f"Travelpayouts quota exhausted ({priority}): {path}")
+        if entry:
+            return entry["data"], entry["at"]
+        if priority == quota.BACKGROUND:
+            raise quota.QuotaExhausted(path)
+        return None, None
+
+    data, fetched_at = request_travelpayouts(path, params, timeout)
+    if data is None and entry:
+        return entry["data"], entry["at"]
+    return data, fetched_at
+
+
+def refresh_stale_prices():
+    """Atualiza as respostas velhas agendadas, dentro da parte da cota do cron."""
+    refreshed = 0
+    pending = quota.pending_refreshes(REFRESH_BATCH)
+    for i, item in enumerate(pending):
+        if not quota.acquire(quota.BACKGROUND):
+            # Sem cota sobrando: o restante volta para a próxima execução
+            for rest in pending[i:]:
+                quota.schedule_refresh(rest["path"], rest["params"])
+            break
+        data, _ = request_travelpayouts(item["path"], item["params"])
+        if data is not None:
+            refreshed += 1
+    return refreshed
+
+
+def fetch_prices_for_dates(origin, destination, departure_date, return_date=None, one_way=False,
+                           priority=quota.INTERACTIVE):
+    """Consulta /prices_for_dates e retorna a lista bruta de voos.
+
+    Cada voo leva `cached_at`, o momento em que a Travelpayouts foi consultada.
+    """
     params = {
         "origin": origin,
         "destination": destination,
         "departure_at": departure_date,
         "currency": "brl",
         "sorting": "price",
-        "limit": 10,
-        "token": TRAVELPAYOUTS_TOKEN
+        "limit": SEARCH_RESULTS_LIMIT,
     }
 
     if return_date:
         params["return_at"] = return_date
+    if one_way:
+        params["one_way"] = "true"
 
-    query_string = urllib.parse.urlencode(params)
-    url = f"{TRAVELPAYOUTS_BASE_URL}/aviasales/v3/prices_for_dates?{query_string}"
+    data, fetched_at = travelpayouts_get("/aviasales/v3/prices_for_dates", params, priority)
+    if not data or not data.get("success"):
+        return []
+    return [dict(flight, cached_at=fetched_at) for flight in data.get("data", [])]
 
-    try:
-        req = urllib.request.Request(url)
-        with urllib.request.urlopen(req, timeout=30) as response:
-            data = json.loads(response.read().decode())
 
-            if not data.get("success"):
-                return []
+def legs_connect(outbound, inbound, open_jaw=ROUND_TRIP_OPEN_JAW):
+    """Verifica se a volta fecha a viagem da ida.
 
-            offers = []
-            for flight in data.get("data", [])[:5]:
-                price_per_person = float(flight.get("price", 0))
-                total_price = price_per_person * adults
+    Sem open-jaw os aeroportos precisam coincidir (chega em GIG, volta de GIG);
+    com open-jaw basta a mesma cidade (chega em GIG, volta do SDU).
+    """
+    if open_jaw:
+        return (outbound["destination"] == inbound["origin"] and
+                inbound["destination"] == outbound["origin"])
+    return (outbound["destination_airport"] == inbound["origin_airport"] and
+            inbound["destination_airport"] == outbound["origin_airport"])
 
-                offers.append({
-                    "price": total_price,
-                    "airline": flight.get("airline", "N/A"),
-                    "stops": flight.get("transfers", 0),
-                    "departure": flight.get("departure_at", ""),
-                    "return": flight.get("return_at", ""),
-                })
 
-            return sorted(offers, key=lambda x: x["price"])
+def cheapest_leg_pairs(outbound, inbound, k, open_jaw=ROUND_TRIP_OPEN_JAW):
+    """Retorna os k pares (ida, volta) mais baratos que respeitam legs_connect.
 
-    except (urllib.error.URLError, json.JSONDecodeError) as e:
-        print(f"Flight search by date error: {e}")
+    As duas listas são ordenadas por preço e os pares são visitados em ordem
+    crescente de soma com um heap (k-smallest pairs), sem gerar o produto inteiro.
+    Cada ida entra no heap quando a anterior sai com a volta mais barata: pares
+    descartados por legs_connect não escondem idas mais caras que conectam.
+    """
+    outbound = sorted(outbound, key=lambda f: f["price"])
+    inbound = sorted(inbound, key=lambda f: f["price"])
+    if not outbound or not inbound or k <= 0:
         return []
 
+    heap = [(outbound[0]["price"] + inbound[0]["price"], 0, 0)]
+
+    pairs = []
+    visited = 0
+    while heap and len(pairs) < k and visited < k * LEG_PAIRS_SCAN_FACTOR:
+        _, i, j = heapq.heappop(heap)
+        visited += 1
+        if legs_connect(outbound[i], inbound[j], open_jaw):
+            pairs.append((outbound[i], inbound[j]))
+        if j == 0 and i + 1 < len(outbound):
+            heapq.heappush(heap, (outbound[i + 1]["price"] + inbound[0]["price"], i + 1, 0))
+        if j + 1 < len(inbound):
+            heapq.heappush(heap, (outbound[i]["price"] + inbound[j + 1]["price"], i, j + 1))
+    return pairs
+
+
+def normalize_leg(flight, origin, destination):
+    """Preenche cidade/aeroporto de um trecho com os códigos pedidos quando ausentes."""
+    return {
+        "price": float(flight.get("price", 0)),
+        "airline": flight.get("airline", "N/A"),
+        "transfers": flight.get("transfers", 0),
+        "departure_at": flight.get("departure_at", ""),
+        "origin": flight.get("origin") or origin,
+        "destination": flight.get("destination") or destination,
+        "origin_airport": flight.get("origin_airport") or flight.get("origin") or origin,
+        "destination_airport": flight.get("destination_airport") or flight.get("destination") or destination,
+        "cached_at": flight.get("cached_at"),
+    }
+
+
+def search_flights_by_date(origin, destination, departure_date, return_date=None, adults=1):
+    """Busca voos por data específica.
+
+    Com data de volta, busca em paralelo a tarifa ida+volta e os dois trechos
+    só ida, e combina os trechos mais baratos como opções adicionais.
+    """
+    if not return_date:
+        flights = fetch_prices_for_dates(origin, destination, departure_date)
+        bundled, outbound, inbound = flights, [], []
+    else:
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            bundled_future = pool.submit(fetch_prices_for_dates, origin, destination, departure_date, return_date)
+            outbound_future = pool.submit(fetch_prices_for_dates, origin, destination, departure_date, None, True)
+            inbound_future = pool.submit(fetch_prices_for_dates, destination, origin, return_date, None, True)
+            bundled = bundled_future.result()
+            outbound = [normalize_leg(f, origin, destination) for f in outbound_future.result()]
+            inbound = [normalize_leg(f, destination, origin) for f in inbound_future.result()]
+
+    offers = []
+    for flight in bundled:
+        price_per_person = float(flight.get("price", 0))
+        total_price = price_per_person * adults
+
+        offers.append({
+            "price": total_price,
+            "airline": flight.get("airline", "N/A"),
+            "stops": flight.get("transfers", 0),
+            "departure": flight.get("departure_at", ""),
+            "return": flight.get("return_at", ""),
+            "cached_at": flight.get("cached_at"),
+        })
+
+    for out_leg, in_leg in cheapest_leg_pairs(outbound, inbound, SEARCH_RESULTS_LIMIT):
+        airlines = out_leg["airline"] if out_leg["airline"] == in_leg["airline"] else f"{out_leg['airline']}/{in_leg['airline']}"
+        offers.append({
+            "price": (out_leg["price"] + in_leg["price"]) * adults,
+            "airline": airlines,
+            "stops": max(out_leg["transfers"], in_leg["transfers"]),
+            "departure": out_leg["departure_at"],
+            "return": in_leg["departure_at"],
+            "cached_at": min(out_leg["cached_at"], in_leg["cached_at"]),
+        })
+
+    return sorted(offers, key=lambda x: x["price"])
+
 
 def search_cheap_prices(origin, destination, adults=1):
     """Busca preços mais baratos em cache (fallback)."""
@@ -272,40 +465,29 @@ def search_cheap_prices(origin, destination, adults=1):
         "origin": origin,
         "destination": destination,
         "currency": "brl",
-        "token": TRAVELPAYOUTS_TOKEN
     }
 
-    query_string = urllib.parse.urlencode(params)
-    url = f"{TRAVELPAYOUTS_BASE_URL}/v1/prices/cheap?{query_string}"
-
-    try:
-        req = urllib.request.Request(url)
-        with urllib.request.urlopen(req, timeout=30) as response:
-            data = json.loads(response.read().decode())
-
-            if not data.get("success"):
-                return []
-
-            offers = []
-            dest_data = data.get("data", {}).get(destination, {})
+    data, fetched_at = travelpayouts_get("/v1/prices/cheap", params)
+    if not data or not data.get("success"):
+        return []
 
-            for key, flight in list(dest_data.items())[:5]:
-                price_per_person = float(flight.get("price", 0))
-                total_price = price_per_person * adults
+    offers = []
+    dest_data = data.get("data", {}).get(destination, {})
 
-                offers.append({
-                    "price": total_price,
-                    "airline": flight.get("airline", "N/A"),
-                    "stops": flight.get("transfers", 0),
-                    "departure": flight.get("departure_date", ""),
-                    "return": flight.get("return_date", ""),
-                })
+    for key, flight in dest_data.items():
+        price_per_person = float(flight.get("price", 0))
+        total_price = price_per_person * adults
 
-            return sorted(offers, key=lambda x: x["price"])
+        offers.append({
+            "price": total_price,
+            "airline": flight.get("airline", "N/A"),
+            "stops": flight.get("transfers", 0),
+            "departure": flight.get("departure_date", ""),
+            "return": flight.get("return_date", ""),
+            "cached_at": fetched_at,
+        })
 
-    except (urllib.error.URLError, json.JSONDecodeError) as e:
-        print(f"Cheap prices search error: {e}")
-        return []
+    return sorted(offers, key=lambda x: x["price"])
 
 
 def check_route_has_data(origin, destination):
@@ -313,52 +495,81 @@ def check_route_has_data(origin, destination):
     if not TRAVELPAYOUTS_TOKEN:
         return False, []
 
+    # Mesma consulta do search_cheap_prices: compartilha o cache
     params = {
         "origin": origin,
         "destination": destination,
         "currency": "brl",
-        "token": TRAVELPAYOUTS_TOKEN
     }
 
-    query_string = urllib.parse.urlencode(params)
-    url = f"{TRAVELPAYOUTS_BASE_URL}/v1/prices/cheap?{query_string}"
-
-    try:
-        req = urllib.request.Request(url)
-        with urllib.request.urlopen(req, timeout=15) as response:
-            data = json.loads(response.read().decode())
-            has_data = bool(data.get("data", {}).get(destination))
-            return has_data, []
-    except:
-        return False, []
+    data, _ = travelpayouts_get("/v1/prices/cheap", params, timeout=15)
+    has_data = bool(data and data.get("data", {}).get(destination))
+    return has_data, []
 
 
-def get_alternative_destinations(origin):
-    """Busca destinos alternativos com dados disponíveis."""
+def fetch_alternative_destinations(origin, priority=quota.BACKGROUND):
+    """Consulta na API os destinos mais baratos a partir de uma origem."""
     if not TRAVELPAYOUTS_TOKEN:
         return []
 
-    url = f"{TRAVELPAYOUTS_BASE_URL}/v2/prices/latest?origin={origin}&currency=brl&limit=10&token={TRAVELPAYOUTS_TOKEN}"
+    params = {
+        "origin": origin,
+        "currency": "brl",
+        "sorting": "price",
+        "limit": 30,
+    }
 
     try:
-        req = urllib.request.Request(url)
-        with urllib.request.urlopen(req, timeout=15) as response:
-            data = json.loads(response.read().decode())
-            destinations = []
-            for flight in data.get("data", [])[:6]:
-                dest_code = flight.get("destination", "")
-                # Buscar nome do aeroporto
-                for airport in ALL_AIRPORTS:
-                    if airport["code"] == dest_code:
-                        destinations.append({
-                            "code": dest_code,
-                            "city": airport["city"],
-                            "price": flight.get("value", 0)
-                        })
-                        break
-            return destinations
-    except:
-        return []
+        data, _ = travelpayouts_get("/v2/prices/latest", params, priority, timeout=15)
+    except quota.QuotaExhausted:
+        return None
+    if data is None:
+        return None
+
+    # Menor preço por destino; cidade pela base local quando conhecida
+    cheapest = {}
+    for flight in data.get("data", []):
+        dest_code = flight.get("destination", "")
+        price = flight.get("value", 0)
+        if dest_code and dest_code != origin and (dest_code not in cheapest or price < cheapest[dest_code]):
+            cheapest[dest_code] = price
+
+    destinations = [
+        {"code": code, "city": AIRPORTS_BY_CODE.get(code, {}).get("city", code), "price": price}
+        for code, price in sorted(cheapest.items(), key=lambda item: item[1])
+    ]
+    return destinations[:ALTERNATIVES_PER_ORIGIN]
+
+
+def refresh_alternative_destinations(origins=None):
+    """Recalcula a tabela de destinos alternativos de cada origem atendida."""
+    origins = origins or [a["code"] for a in BRAZILIAN_AIRPORTS]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = dict(zip(origins, pool.map(fetch_alternative_destinations, origins)))
+
+    refreshed = 0
+    for origin, destinations in results.items():
+        # Em caso de falha mantém a tabela anterior até expirar
+        if destinations is None:
+            continue
+        redis_set(f"alternatives:{origin}", destinations, ex=ALTERNATIVES_TTL)
+        refreshed += 1
+    return refreshed
+
+
+def get_alternative_destinations(origin):
+    """Busca destinos alternativos na tabela pré-calculada da origem.
+
+    O cron só pré-calcula as origens brasileiras; outras (ex: LIS) são
+    consultadas na hora e guardadas na tabela.
+    """
+    destinations = redis_get(f"alternatives:{origin}")
+    if destinations is None:
+        destinations = fetch_alternative_destinations(origin, quota.INTERACTIVE)
+        if destinations is None:
+            return []
+        redis_set(f"alternatives:{origin}", destinations, ex=ALTERNATIVES_TTL)
+    return destinations
 
 
 def format_brl(value):
@@ -366,6 +577,164 @@ def format_brl(value):
     return f"R$ {value:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
 
 
+def freshness_label(age):
+    """Idade do preço em texto curto (ex: 40 min, 3 h)."""
+    if age < 3600:
+        return f"{int(age // 60)} min"
+    return f"{int(age // 3600)} h"
+
+
+def compact_offers(offers):
+    """Converte ofertas em linhas [preço, cia, paradas, ida, volta]."""
+    return [
+        [o["price"], o["airline"], o["stops"], (o.get("departure") or "")[:10], (o.get("return") or "")[:10]]
+        for o in offers
+    ]
+
+
+def render_results(results, page=0, sort="p", direct_only=False):
+    """Monta o texto e o teclado de uma página dos resultados guardados.
+
+    sort: "p" (preço) ou "s" (paradas, depois preço).
+    """
+    rows = results["rows"]
+    search_id = results["id"]
+    if direct_only:
+        rows = [r for r in rows if r[2] == 0]
+    if sort == "s":
+        rows = sorted(rows, key=lambda r: (r[2], r[0]))
+    else:
+        rows = sorted(rows, key=lambda r: r[0])
+
+    pages = max(1, -(-len(rows) // RESULTS_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    start = page * RESULTS_PAGE_SIZE
+
+    text = f"*Voos: {results['title']}*\n\n"
+    if not rows:
+        text += "Nenhum voo direto nesta busca.\n\n"
+    for i, (price, airline, stops, departure, ret) in enumerate(rows[start:start + RESULTS_PAGE_SIZE], start + 1):
+        stops_text = "Direto" if stops == 0 else f"{stops} parada(s)"
+        text += f"*{i}. {format_brl(price)}*\n"
+        text += f"   {airline} | {stops_text}\n"
+        if departure:
+            text += f"   Ida: {departure}\n"
+        if ret:
+            text += f"   Volta: {ret}\n"
+        text += "\n"
+
+    if pages > 1:
+        text += f"Página {page + 1} de {pages}\n"
+    age = time.time() - (results.get("cached_at") or time.time())
+    if age >= quota.FRESH_TTL:
+        # Servido do cache perto do limite da cota; o cron atualiza em seguida
+        text += f"_Preços de {freshness_label(age)} atrás (atualizando)_"
+    else:
+        text += "_Preços em cache (podem variar)_"
+
+    flag = "1" if direct_only else "0"
+    nav = []
+    if page > 0:
+        nav.append({"text": "Anteriores", "callback_data": f"res:{search_id}_{page - 1}_{sort}_{flag}"})
+    if page < pages - 1:
+        nav.append({"text": "Mais resultados", "callback_data": f"res:{search_id}_{page + 1}_{sort}_{flag}"})
+
+    other_sort = "p" if sort == "s" else "s"
+    options = [
+        {"text": "Ordenar por preço" if sort == "s" else "Menos paradas", "callback_data": f"res:{search_id}_0_{other_sort}_{flag}"},
+        {"text": "Todos os voos" if direct_only else "Só diretos", "callback_data": f"res:{search_id}_0_{sort}_{'0' if direct_only else '1'}"},
+    ]
+
+    keyboard = {"inline_keyboard": ([nav] if nav else []) + [
+        options,
+        [{"text": "Nova Busca", "callback_data": "search_now"}],
+        [{"text": "Criar Alerta", "callback_data": "new_monitor"}],
+        [{"text": "Menu Principal", "callback_data": "main_menu"}]
+    ]}
+    return text, keyboard
+
+
+# Estado compacto nos botões
+#
+# Os passos que só precisam de origem, destino, datas e adultos levam esses
+# dados no próprio callback_data (limite de 64 bytes do Telegram), em binário
+# + base64url com HMAC truncado; o Redis só é usado quando o próximo passo é
+# uma mensagem de texto.
+
+TRIP_FORMAT = ">B3s3sHHBI"   # modo, origem, destino, ida, volta, adultos, preço máx. (centavos)
+TRIP_EPOCH = date(2000, 1, 1)
+TRIP_TAG_SIZE = 6
+
+
+def callback_signature(user_id, payload):
+    key = (CALLBACK_SECRET or TELEGRAM_TOKEN).encode()
+    return hmac.new(key, str(user_id).encode() + payload, hashlib.sha256).digest()[:TRIP_TAG_SIZE]
+
+
+def trip_day(value):
+    return (datetime.strptime(value, "%Y-%m-%d").date() - TRIP_EPOCH).days if value else 0
+
+
+def airport_label(code):
+    airport = AIRPORTS_BY_CODE.get(code)
+    return f"{airport['city']} - {airport['name']}" if airport else code
+
+
+def encode_trip(user_id, data):
+    """Codifica os dados da viagem em um token assinado (30 caracteres)."""
+    payload = struct.pack(
+        TRIP_FORMAT,
+        1 if data.get("mode") == "search" else 0,
+        (data.get("origin") or "").encode(),
+        (data.get("destination") or "").encode(),
+        trip_day(data.get("departure_date")),
+        trip_day(data.get("return_date")),
+        data.get("adults") or 0,
+        min(int(round((data.get("max_price") or 0) * 100)), 0xFFFFFFFF),
+    )
+    token = payload + callback_signature(user_id, payload)
+    return base64.urlsafe_b64encode(token).decode().rstrip("=")
+
+
+def decode_trip(user_id, token):
+    """Decodifica um token de encode_trip; None se inválido ou de outro usuário."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload, tag = raw[:-TRIP_TAG_SIZE], raw[-TRIP_TAG_SIZE:]
+        if not hmac.compare_digest(tag, callback_signature(user_id, payload)):
+            return None
+        mode, origin, destination, departure, ret, adults, max_price = struct.unpack(TRIP_FORMAT, payload)
+    except (ValueError, struct.error):
+        return None
+
+    data = {}
+    if mode:
+        data["mode"] = "search"
+    for field, code in (("origin", origin), ("destination", destination)):
+        code = code.rstrip(b"\0").decode()
+        if code:
+            data[field] = code
+            data[f"{field}_name"] = airport_label(code)
+    if departure:
+        data["departure_date"] = (TRIP_EPOCH + timedelta(days=departure)).isoformat()
+    data["return_date"] = (TRIP_EPOCH + timedelta(days=ret)).isoformat() if ret else None
+    if adults:
+        data["adults"] = adults
+    if max_price:
+        data["max_price"] = max_price / 100
+    return data
+
+
+def adults_keyboard(user_id, data):
+    return {"inline_keyboard": [
+        [{"text": str(n), "callback_data": f"adults:{encode_trip(user_id, dict(data, adults=n))}"} for n in range(1, 5)],
+        [{"text": "Cancelar", "callback_data": "main_menu"}]
+    ]}
+
+
+CANCEL_KEYBOARD = {"inline_keyboard": [[{"text": "Cancelar", "callback_data": "main_menu"}]]}
+
+
 def main_menu(chat_id):
     """Mostra menu principal."""
     keyboard = {
@@ -373,12 +742,29 @@ def main_menu(chat_id):
             [{"text": "Buscar Voo Agora", "callback_data": "search_now"}],
             [{"text": "Novo Monitoramento", "callback_data": "new_monitor"}],
             [{"text": "Meus Monitoramentos", "callback_data": "my_monitors"}],
+            [{"text": "Frequência dos Alertas", "callback_data": "alert_prefs"}],
             [{"text": "Ajuda", "callback_data": "help"}]
         ]
     }
     send_message(chat_id, "*Monitor de Viagens*\n\nEscolha uma opção:", keyboard)
 
 
+def handle_alert_prefs(chat_id, user_id):
+    """Mostra e permite trocar a frequência dos alertas do usuário."""
+    prefs = redis_get(f"prefs:{user_id}") or {}
+    current = prefs.get("digest", DIGEST_IMMEDIATE)
+
+    text = ("*Frequência dos Alertas*\n\n"
+            f"Atual: *{DIGEST_MODES[current]}*\n\n"
+            "No modo resumo, as mudanças de preço dos seus monitoramentos chegam juntas em uma única mensagem.")
+    keyboard_buttons = [
+        [{"text": f"{'» ' if mode == current else ''}{label}", "callback_data": f"digest:{mode}"}]
+        for mode, label in DIGEST_MODES.items()
+    ]
+    keyboard_buttons.append([{"text": "Menu Principal", "callback_data": "main_menu"}])
+    send_message(chat_id, text, {"inline_keyboard": keyboard_buttons})
+
+
 def handle_my_monitors(chat_id, user_id):
     """Mostra monitoramentos do usuário."""
     monitors = redis_get(f"monitors:{user_id}") or []
@@ -396,7 +782,7 @@ def handle_my_monitors(chat_id, user_id):
     for i, m in enumerate(monitors):
         text += f"*{i+1}. {m['origin']} → {m['destination']}*\n"
         text += f"   Data: {m['departure_date']}\n\n"
-        keyboard_buttons.append([{"text": f"Excluir #{i+1}", "callback_data": f"delete_{i}"}])
+        keyboard_buttons.append([{"text": f"Excluir #{i+1}", "callback_data": f"delete:{i}"}])
 
     keyboard_buttons.append([{"text": "Criar Novo", "callback_data": "new_monitor"}])
     keyboard_buttons.append([{"text": "Menu Principal", "callback_data": "main_menu"}])
@@ -488,15 +874,13 @@ def handle_message(message):
             send_message(chat_id, f"Nenhum aeroporto encontrado para '*{text}*'.\n\nTente outra cidade.", keyboard)
             return
 
-        data["airports"] = {a["code"]: f"{a['city']} - {a['name']}" for a in airports}
-        prefix = "origin_" if state == "origin" else "sorigin_"
-
+        # O botão leva a origem escolhida; o estado continua pedindo a cidade
         keyboard = {"inline_keyboard": [
-            [{"text": f"{a['code']} - {a['name'] or a['city']}", "callback_data": f"{prefix}{a['code']}"}]
+            [{"text": f"{a['code']} - {a['name'] or a['city']}",
+              "callback_data": f"origin:{encode_trip(user_id, dict(data, origin=a['code']))}"}]
             for a in airports
         ] + [[{"text": "Cancelar", "callback_data": "main_menu"}]]}
 
-        redis_set(f"state:{user_id}", {"state": state + "_select", "data": data})
         send_message(chat_id, f"*Aeroportos para '{text}':*\n\nEscolha:", keyboard)
 
     # Destino - buscar aeroportos
@@ -504,22 +888,19 @@ def handle_message(message):
         airports = search_airports(text)
         if not airports:
             keyboard = {"inline_keyboard": [
-                [{"text": "Tentar Novamente", "callback_data": "retry_dest"}],
+                [{"text": "Tentar Novamente", "callback_data": f"retry_dest:{encode_trip(user_id, data)}"}],
                 [{"text": "Mudar Origem", "callback_data": "search_now" if state == "search_destination" else "new_monitor"}],
                 [{"text": "Menu Principal", "callback_data": "main_menu"}]
             ]}
             send_message(chat_id, f"Nenhum aeroporto encontrado para '*{text}*'.\n\nTente outra cidade.", keyboard)
             return
 
-        data["airports"] = {a["code"]: f"{a['city']} - {a['name']}" for a in airports}
-        prefix = "dest_" if state == "destination" else "sdest_"
-
         keyboard = {"inline_keyboard": [
-            [{"text": f"{a['code']} - {a['name'] or a['city']}", "callback_data": f"{prefix}{a['code']}"}]
+            [{"text": f"{a['code']} - {a['name'] or a['city']}",
+              "callback_data": f"dest:{encode_trip(user_id, dict(data, destination=a['code']))}"}]
             for a in airports
         ] + [[{"text": "Cancelar", "callback_data": "main_menu"}]]}
 
-        redis_set(f"state:{user_id}", {"state": state + "_select", "data": data})
         send_message(chat_id, "*Escolha o aeroporto de destino:*", keyboard)
 
     # Data de ida
@@ -529,12 +910,15 @@ def handle_message(message):
             if date.date() < datetime.now().date():
                 send_message(chat_id, "A data não pode ser no passado!", cancel_keyboard)
                 return
+            if (date.date() - datetime.now().date()).days > MAX_DAYS_AHEAD:
+                send_message(chat_id, "A data deve ser em até 1 ano!", cancel_keyboard)
+                return
 
             data["departure_date"] = date.strftime("%Y-%m-%d")
             next_state = "return_date" if state == "departure_date" else "search_return_date"
 
             keyboard = {"inline_keyboard": [
-                [{"text": "Só ida (sem volta)", "callback_data": "skip_return"}],
+                [{"text": "Só ida (sem volta)", "callback_data": f"skip_return:{encode_trip(user_id, data)}"}],
                 [{"text": "Cancelar", "callback_data": "main_menu"}]
             ]}
 
@@ -551,18 +935,13 @@ def handle_message(message):
             if date.date() < departure.date():
                 send_message(chat_id, "A volta deve ser após a ida!", cancel_keyboard)
                 return
+            if (date.date() - datetime.now().date()).days > MAX_DAYS_AHEAD:
+                send_message(chat_id, "A data deve ser em até 1 ano!", cancel_keyboard)
+                return
 
             data["return_date"] = date.strftime("%Y-%m-%d")
-            next_state = "adults" if state == "return_date" else "search_adults"
-
-            keyboard = {"inline_keyboard": [
-                [{"text": "1", "callback_data": "adults_1"}, {"text": "2", "callback_data": "adults_2"},
-                 {"text": "3", "callback_data": "adults_3"}, {"text": "4", "callback_data": "adults_4"}],
-                [{"text": "Cancelar", "callback_data": "main_menu"}]
-            ]}
-
-            redis_set(f"state:{user_id}", {"state": next_state, "data": data})
-            send_message(chat_id, "*Quantos adultos?*", keyboard)
+            # Próximo passo é um botão: os dados vão nele, sem gravar estado
+            send_message(chat_id, "*Quantos adultos?*", adults_keyboard(user_id, data))
         except ValueError:
             send_message(chat_id, "Formato inválido. Use DD/MM/AAAA", cancel_keyboard)
 
@@ -578,166 +957,203 @@ def handle_message(message):
             send_message(chat_id, "Valor inválido. Digite apenas números (ex: 1500)", cancel_keyboard)
 
 
-def handle_callback(callback_query):
-    """Processa cliques em botões."""
-    chat_id = callback_query["message"]["chat"]["id"]
-    user_id = callback_query["from"]["id"]
-    callback_id = callback_query["id"]
-    action = callback_query.get("data", "")
+def callback_main_menu(chat_id, user_id, arg, message_id):
+    redis_set(f"state:{user_id}", None)
+    main_menu(chat_id)
 
-    answer_callback(callback_id)
 
-    state_data = redis_get(f"state:{user_id}") or {"state": "", "data": {}}
-    data = state_data.get("data", {})
+def callback_new_monitor(chat_id, user_id, arg, message_id):
+    redis_set(f"state:{user_id}", {"state": "origin", "data": {}})
+    send_message(chat_id, "*Novo Monitoramento*\n\nDigite o nome da cidade de origem:", CANCEL_KEYBOARD)
 
-    cancel_keyboard = {"inline_keyboard": [[{"text": "Cancelar", "callback_data": "main_menu"}]]}
 
-    if action == "main_menu":
-        redis_set(f"state:{user_id}", None)
-        main_menu(chat_id)
+def callback_search_now(chat_id, user_id, arg, message_id):
+    redis_set(f"state:{user_id}", {"state": "search_origin", "data": {"mode": "search"}})
+    send_message(chat_id, "*Buscar Voo*\n\nDigite o nome da cidade de origem:", CANCEL_KEYBOARD)
 
-    elif action == "new_monitor":
-        redis_set(f"state:{user_id}", {"state": "origin", "data": {}})
-        send_message(chat_id, "*Novo Monitoramento*\n\nDigite o nome da cidade de origem:", cancel_keyboard)
 
-    elif action == "search_now":
-        redis_set(f"state:{user_id}", {"state": "search_origin", "data": {"mode": "search"}})
-        send_message(chat_id, "*Buscar Voo*\n\nDigite o nome da cidade de origem:", cancel_keyboard)
+def callback_my_monitors(chat_id, user_id, arg, message_id):
+    handle_my_monitors(chat_id, user_id)
 
-    elif action == "my_monitors":
-        handle_my_monitors(chat_id, user_id)
 
-    elif action == "help":
-        handle_help(chat_id)
+def callback_help(chat_id, user_id, arg, message_id):
+    handle_help(chat_id)
 
-    elif action.startswith("origin_") or action.startswith("sorigin_"):
-        code = action.replace("origin_", "").replace("sorigin_", "")
-        data["origin"] = code
-        data["origin_name"] = data.get("airports", {}).get(code, code)
 
-        is_search = action.startswith("s")
-        next_state = "search_destination" if is_search else "destination"
+def callback_alert_prefs(chat_id, user_id, arg, message_id):
+    handle_alert_prefs(chat_id, user_id)
 
-        redis_set(f"state:{user_id}", {"state": next_state, "data": data})
-        send_message(chat_id, f"Origem: *{data['origin_name']}* ({code})\n\nDigite a cidade de destino:", cancel_keyboard)
 
-    elif action.startswith("dest_") or action.startswith("sdest_"):
-        code = action.replace("dest_", "").replace("sdest_", "")
-        data["destination"] = code
-        data["destination_name"] = data.get("airports", {}).get(code, code)
+def callback_digest(chat_id, user_id, mode, message_id):
+    if mode in DIGEST_MODES:
+        prefs = redis_get(f"prefs:{user_id}") or {}
+        prefs["digest"] = mode
+        redis_set(f"prefs:{user_id}", prefs)
+    handle_alert_prefs(chat_id, user_id)
 
-        is_search = action.startswith("s")
-        next_state = "search_departure_date" if is_search else "departure_date"
 
-        redis_set(f"state:{user_id}", {"state": next_state, "data": data})
-        send_message(chat_id, f"Origem: *{data.get('origin_name')}*\nDestino: *{data['destination_name']}*\n\nDigite a data de ida (DD/MM/AAAA):", cancel_keyboard)
+def callback_origin(chat_id, user_id, data, message_id):
+    next_state = "search_destination" if data.get("mode") == "search" else "destination"
+    redis_set(f"state:{user_id}", {"state": next_state, "data": data})
+    send_message(chat_id, f"Origem: *{data['origin_name']}* ({data['origin']})\n\nDigite a cidade de destino:", CANCEL_KEYBOARD)
 
-    elif action == "skip_return":
-        data["return_date"] = None
-        is_search = state_data.get("state", "").startswith("search")
-        next_state = "search_adults" if is_search else "adults"
 
+def callback_dest(chat_id, user_id, data, message_id):
+    next_state = "search_departure_date" if data.get("mode") == "search" else "departure_date"
+    redis_set(f"state:{user_id}", {"state": next_state, "data": data})
+    send_message(chat_id, f"Origem: *{data.get('origin_name')}*\nDestino: *{data['destination_name']}*\n\nDigite a data de ida (DD/MM/AAAA):", CANCEL_KEYBOARD)
+
+
+def callback_skip_return(chat_id, user_id, data, message_id):
+    send_message(chat_id, "*Quantos adultos?*", adults_keyboard(user_id, data))
+
+
+def callback_adults(chat_id, user_id, data, message_id):
+    if data.get("mode") != "search":
+        # Perguntar preço máximo (resposta em texto: precisa do estado)
         keyboard = {"inline_keyboard": [
-            [{"text": "1", "callback_data": "adults_1"}, {"text": "2", "callback_data": "adults_2"},
-             {"text": "3", "callback_data": "adults_3"}, {"text": "4", "callback_data": "adults_4"}],
+            [{"text": "Pular (sem limite)", "callback_data": f"skip_max_price:{encode_trip(user_id, data)}"}],
             [{"text": "Cancelar", "callback_data": "main_menu"}]
         ]}
-        redis_set(f"state:{user_id}", {"state": next_state, "data": data})
-        send_message(chat_id, "*Quantos adultos?*", keyboard)
+        redis_set(f"state:{user_id}", {"state": "max_price", "data": data})
+        send_message(chat_id, "*Preço máximo?*\n\nDigite o valor em reais ou pule:", keyboard)
+        return
 
-    elif action.startswith("adults_"):
-        adults = int(action.split("_")[1])
-        data["adults"] = adults
+    # Executar busca
+    send_message(chat_id, "*Buscando voos...*")
+    offers = search_flights(data["origin"], data["destination"], data["departure_date"], data.get("return_date"), data["adults"])
 
-        is_search = state_data.get("state", "").startswith("search")
-
-        if is_search:
-            # Executar busca
-            send_message(chat_id, "*Buscando voos...*")
-            offers = search_flights(data["origin"], data["destination"], data["departure_date"], data.get("return_date"), adults)
-
-            if not offers:
-                keyboard = {"inline_keyboard": [
-                    [{"text": "Tentar Outras Datas", "callback_data": "retry_dates"}],
-                    [{"text": "Nova Busca", "callback_data": "search_now"}],
-                    [{"text": "Menu Principal", "callback_data": "main_menu"}]
-                ]}
-                # Salvar dados para retry
-                redis_set(f"state:{user_id}", {"state": "no_results", "data": data})
-                send_message(chat_id, "*Nenhum voo encontrado para essa data*\n\nOs preços são baseados em buscas recentes. Tente datas diferentes ou outro destino.", keyboard)
-            else:
-                text = f"*Voos: {data.get('origin_name', data['origin'])} → {data.get('destination_name', data['destination'])}*\n\n"
-                for i, o in enumerate(offers, 1):
-                    stops = "Direto" if o["stops"] == 0 else f"{o['stops']} parada(s)"
-                    text += f"*{i}. {format_brl(o['price'])}*\n"
-                    text += f"   {o['airline']} | {stops}\n"
-                    if o.get("departure"):
-                        dep_date = o["departure"][:10] if o["departure"] else ""
-                        text += f"   Ida: {dep_date}\n"
-                    if o.get("return"):
-                        ret_date = o["return"][:10] if o["return"] else ""
-                        text += f"   Volta: {ret_date}\n"
-                    text += "\n"
-
-                text += "_Preços em cache (podem variar)_"
-                keyboard = {"inline_keyboard": [
-                    [{"text": "Nova Busca", "callback_data": "search_now"}],
-                    [{"text": "Criar Alerta", "callback_data": "new_monitor"}],
-                    [{"text": "Menu Principal", "callback_data": "main_menu"}]
-                ]}
-                send_message(chat_id, text, keyboard)
-
-            redis_set(f"state:{user_id}", None)
-        else:
-            # Perguntar preço máximo
-            keyboard = {"inline_keyboard": [
-                [{"text": "Pular (sem limite)", "callback_data": "skip_max_price"}],
-                [{"text": "Cancelar", "callback_data": "main_menu"}]
-            ]}
-            redis_set(f"state:{user_id}", {"state": "max_price", "data": data})
-            send_message(chat_id, "*Preço máximo?*\n\nDigite o valor em reais ou pule:", keyboard)
+    if not offers:
+        # O botão de outras datas leva origem e destino, então o estado pode ser limpo
+        keyboard = {"inline_keyboard": [
+            [{"text": "Tentar Outras Datas", "callback_data": f"retry_dates:{encode_trip(user_id, data)}"}],
+            [{"text": "Nova Busca", "callback_data": "search_now"}],
+            [{"text": "Menu Principal", "callback_data": "main_menu"}]
+        ]}
+        send_message(chat_id, "*Nenhum voo encontrado para essa data*\n\nOs preços são baseados em buscas recentes. Tente datas diferentes ou outro destino.", keyboard)
+    else:
+        title = f"{data.get('origin_name', data['origin'])} → {data.get('destination_name', data['destination'])}"
+        # Guardar o resultado completo para paginar sem nova busca
+        # Id curto da busca nos botões: paginar uma mensagem antiga mostra os resultados dela
+        results = {"id": uuid.uuid4().hex[:8], "title": title, "rows": compact_offers(offers),
+                   "cached_at": min(o.get("cached_at") or int(time.time()) for o in offers)}
+        redis_set(f"results:{user_id}:{results['id']}", results, ex=RESULTS_TTL)
+        text, keyboard = render_results(results)
+        send_message(chat_id, text, keyboard)
 
-    elif action == "skip_max_price":
-        data["max_price"] = None
-        finish_monitor(chat_id, user_id, data)
+    redis_set(f"state:{user_id}", None)
 
-    elif action.startswith("delete_"):
-        idx = int(action.split("_")[1])
-        monitors = redis_get(f"monitors:{user_id}") or []
-        if 0 <= idx < len(monitors):
-            monitors.pop(idx)
-            redis_set(f"monitors:{user_id}", monitors)
 
+def callback_results(chat_id, user_id, arg, message_id):
+    # Paginação/ordenação dos resultados guardados (sem nova busca)
+    search_id, page, sort, direct_only = arg.split("_")
+    results = redis_get(f"results:{user_id}:{search_id}")
+    if not results:
         keyboard = {"inline_keyboard": [
-            [{"text": "Ver Meus Alertas", "callback_data": "my_monitors"}],
-            [{"text": "Criar Novo Alerta", "callback_data": "new_monitor"}],
+            [{"text": "Nova Busca", "callback_data": "search_now"}],
             [{"text": "Menu Principal", "callback_data": "main_menu"}]
         ]}
-        send_message(chat_id, "Monitoramento excluído com sucesso!", keyboard)
+        edit_message(chat_id, message_id, "*Resultados expirados*\n\nFaça uma nova busca.", keyboard)
+        return
 
-    # Retry callbacks
-    elif action == "retry_origin":
-        redis_set(f"state:{user_id}", {"state": "origin", "data": {}})
-        keyboard = {"inline_keyboard": [[{"text": "Menu Principal", "callback_data": "main_menu"}]]}
-        send_message(chat_id, "*Novo Monitoramento*\n\nDigite o nome da cidade de origem:", keyboard)
+    text, keyboard = render_results(results, int(page), sort, direct_only == "1")
+    edit_message(chat_id, message_id, text, keyboard)
+
+
+def callback_skip_max_price(chat_id, user_id, data, message_id):
+    data["max_price"] = None
+    finish_monitor(chat_id, user_id, data)
+
+
+def callback_delete(chat_id, user_id, arg, message_id):
+    idx = int(arg)
+    monitors = redis_get(f"monitors:{user_id}") or []
+    if 0 <= idx < len(monitors):
+        monitors.pop(idx)
+        redis_set(f"monitors:{user_id}", monitors)
+
+    keyboard = {"inline_keyboard": [
+        [{"text": "Ver Meus Alertas", "callback_data": "my_monitors"}],
+        [{"text": "Criar Novo Alerta", "callback_data": "new_monitor"}],
+        [{"text": "Menu Principal", "callback_data": "main_menu"}]
+    ]}
+    send_message(chat_id, "Monitoramento excluído com sucesso!", keyboard)
 
-    elif action == "retry_dest":
-        # Manter a origem e pedir destino novamente
-        keyboard = {"inline_keyboard": [[{"text": "Menu Principal", "callback_data": "main_menu"}]]}
-        origin_name = data.get("origin_name", data.get("origin", ""))
-        send_message(chat_id, f"Origem: *{origin_name}*\n\nDigite o nome da cidade de destino:", keyboard)
 
-    elif action == "retry_dates":
-        # Manter origem e destino, pedir nova data
-        redis_set(f"state:{user_id}", {"state": "search_departure_date", "data": data})
+def callback_retry_origin(chat_id, user_id, arg, message_id):
+    redis_set(f"state:{user_id}", {"state": "origin", "data": {}})
+    keyboard = {"inline_keyboard": [[{"text": "Menu Principal", "callback_data": "main_menu"}]]}
+    send_message(chat_id, "*Novo Monitoramento*\n\nDigite o nome da cidade de origem:", keyboard)
+
+
+def callback_retry_dest(chat_id, user_id, data, message_id):
+    # O estado continua pedindo o destino; o botão só traz o nome da origem
+    keyboard = {"inline_keyboard": [[{"text": "Menu Principal", "callback_data": "main_menu"}]]}
+    origin_name = data.get("origin_name", data.get("origin", ""))
+    send_message(chat_id, f"Origem: *{origin_name}*\n\nDigite o nome da cidade de destino:", keyboard)
+
+
+def callback_retry_dates(chat_id, user_id, data, message_id):
+    # Manter origem e destino, pedir nova data
+    redis_set(f"state:{user_id}", {"state": "search_departure_date", "data": data})
+    keyboard = {"inline_keyboard": [[{"text": "Menu Principal", "callback_data": "main_menu"}]]}
+    origin_name = data.get("origin_name", data.get("origin", ""))
+    dest_name = data.get("destination_name", data.get("destination", ""))
+    send_message(chat_id, f"*{origin_name} → {dest_name}*\n\nDigite uma nova data de ida (DD/MM/AAAA):", keyboard)
+
+
+def callback_confirm_monitor(chat_id, user_id, data, message_id):
+    # Usuário confirmou criar monitor mesmo sem dados
+    create_monitor(chat_id, user_id, data)
+
+
+# callback_data "<nome>" ou "<nome>:<argumento>" -> (função, argumento é viagem assinada)
+CALLBACK_ROUTES = {
+    "main_menu": (callback_main_menu, False),
+    "new_monitor": (callback_new_monitor, False),
+    "search_now": (callback_search_now, False),
+    "my_monitors": (callback_my_monitors, False),
+    "help": (callback_help, False),
+    "alert_prefs": (callback_alert_prefs, False),
+    "digest": (callback_digest, False),
+    "res": (callback_results, False),
+    "delete": (callback_delete, False),
+    "retry_origin": (callback_retry_origin, False),
+    "origin": (callback_origin, True),
+    "dest": (callback_dest, True),
+    "skip_return": (callback_skip_return, True),
+    "adults": (callback_adults, True),
+    "skip_max_price": (callback_skip_max_price, True),
+    "retry_dest": (callback_retry_dest, True),
+    "retry_dates": (callback_retry_dates, True),
+    "confirm_monitor": (callback_confirm_monitor, True),
+}
+
+
+def handle_callback(callback_query):
+    """Processa cliques em botões.
+
+    O estado da conversa vem do próprio botão quando possível; o Redis só é
+    lido pelos passos que precisam dele (resultados, monitoramentos, prefs).
+    """
+    chat_id = callback_query["message"]["chat"]["id"]
+    message_id = callback_query["message"].get("message_id")
+    user_id = callback_query["from"]["id"]
+    answer_callback(callback_query["id"])
+
+    name, _, arg = callback_query.get("data", "").partition(":")
+    route = CALLBACK_ROUTES.get(name)
+    if route and route[1]:
+        arg = decode_trip(user_id, arg)
+
+    if not route or arg is None:
+        # Botão de uma versão anterior ou adulterado
         keyboard = {"inline_keyboard": [[{"text": "Menu Principal", "callback_data": "main_menu"}]]}
-        origin_name = data.get("origin_name", data.get("origin", ""))
-        dest_name = data.get("destination_name", data.get("destination", ""))
-        send_message(chat_id, f"*{origin_name} → {dest_name}*\n\nDigite uma nova data de ida (DD/MM/AAAA):", keyboard)
+        send_message(chat_id, "Este botão expirou. Comece de novo pelo menu.", keyboard)
+        return
 
-    elif action == "confirm_monitor":
-        # Usuário confirmou criar monitor mesmo sem dados
-        create_monitor(chat_id, user_id, data)
+    function, _ = route
+    function(chat_id, user_id, arg, message_id)
 
 
 def finish_monitor(chat_id, user_id, data):
@@ -766,13 +1182,11 @@ Isso acontece porque é uma rota menos buscada. O monitoramento pode não funcio
         text += "\n*Sugestão:* Use o Google Flights para monitorar esta rota específica."
 
         keyboard = {"inline_keyboard": [
-            [{"text": "Criar mesmo assim", "callback_data": "confirm_monitor"}],
+            [{"text": "Criar mesmo assim", "callback_data": f"confirm_monitor:{encode_trip(user_id, data)}"}],
             [{"text": "Escolher outro destino", "callback_data": "new_monitor"}],
             [{"text": "Menu Principal", "callback_data": "main_menu"}]
         ]}
 
-        # Salvar dados para confirmar depois
-        redis_set(f"state:{user_id}", {"state": "confirm_monitor", "data": data})
         send_message(chat_id, text, keyboard)
         return
 
@@ -781,9 +1195,13 @@ Isso acontece porque é uma rota menos buscada. O monitoramento pode não funcio
 
 
 def create_monitor(chat_id, user_id, data):
-    """Cria o monitoramento no banco."""
-    monitors = redis_get(f"monitors:{user_id}") or []
-    monitors.append({
+    """Cria o monitoramento no banco.
+
+    Idempotente: os botões finais ("Criar mesmo assim", "Pular") levam os dados
+    assinados e podem ser tocados de novo, então um monitor igual (mesma rota,
+    adultos e preço máximo) não é duplicado.
+    """
+    monitor = {
         "origin": data["origin"],
         "origin_name": data.get("origin_name", data["origin"]),
         "destination": data["destination"],
@@ -794,8 +1212,12 @@ def create_monitor(chat_id, user_id, data):
         "max_price": data.get("max_price"),
         "chat_id": chat_id,
         "created_at": datetime.now().isoformat()
-    })
-    redis_set(f"monitors:{user_id}", monitors)
+    }
+    identity = ("origin", "destination", "departure_date", "return_date", "adults", "max_price")
+    monitors = redis_get(f"monitors:{user_id}") or []
+    if not any(all(m.get(f) == monitor[f] for f in identity) for m in monitors):
+        monitors.append(monitor)
+        redis_set(f"monitors:{user_id}", monitors)
     redis_set(f"state:{user_id}", None)
 
     text = f"""*Monitoramento Criado!*
@@ -858,3 +1280,11 @@ class handler(BaseHTTPRequestHandler):
             "status": "Bot is running!",
             "timestamp": datetime.now().isoformat()
         }).encode())
+
+
+if __name__ == "__main__":
+    # Modo servidor próprio: python -m api.webhook (use STORAGE_BACKEND=sqlite)
+    from http.server import ThreadingHTTPServer
+    port = int(os.environ.get('PORT', '8000'))
+    print(f"Webhook ouvindo na porta {port}")
+    ThreadingHTTPServer(("", port), handler).serve_forever()
@@ -0,0 +1,236 @@
+"""Build otimizado da landing page.
+
+Gera `dist/` a partir de `index.html`:
+
+- HTML, CSS e JS minificados (todo o CSS crítico continua inline)
+- Fonte Inter auto-hospedada, só com os pesos e caracteres usados na página
+- Font Awesome reduzido aos ícones usados (subset da fonte com fontTools, se instalado)
+- Arquivos com hash no nome (a compressão gzip/brotli fica com o Vercel, na hora)
+
+Uso:
+
+    python build.py
+
+Sem rede, as fontes continuam vindo das CDNs (o restante do build é feito normalmente).
+"""
+import hashlib
+import os
+import re
+import shutil
+import sys
+import urllib.parse
+import urllib.request
+from html import unescape
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from fontTools import subset as font_subset
+except ImportError:
+    font_subset = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(ROOT, "index.html")
+DIST = os.path.join(ROOT, "dist")
+ASSETS = os.path.join(DIST, "assets")
+
+GOOGLE_FONTS_CSS = "https://fonts.googleapis.com/css2"
+FONT_AWESOME_BASE = "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1"
+FONT_AWESOME_STYLES = {
+    # classe: (arquivo da fonte, família, peso)
+    "fas": ("fa-solid-900", "Font Awesome 6 Free", 900),
+    "fab": ("fa-brands-400", "Font Awesome 6 Brands", 400),
+}
+
+# User-Agent moderno para o Google Fonts responder com woff2
+BROWSER_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+HTTP_TIMEOUT = 20
+
+
+def fetch(url):
+    req = urllib.request.Request(url, headers={"User-Agent": BROWSER_UA})
+    with urllib.request.urlopen(req, timeout=HTTP_TIMEOUT) as response:
+        return response.read()
+
+
+def write_asset(name, ext, content):
+    """Grava um asset com hash do conteúdo no nome e retorna a URL pública."""
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    filename = f"{name}.{digest}{ext}"
+    with open(os.path.join(ASSETS, filename), "wb") as f:
+        f.write(content)
+    return f"/assets/{filename}"
+
+
+# Minificação
+
+def minify_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{}:;,>])\s*", r"\1", css)
+    return css.replace(";}", "}").strip()
+
+
+def minify_js(js):
+    lines = []
+    for line in js.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("//"):
+            continue
+        lines.append(stripped)
+    # Mantém as quebras de linha para não depender de ponto e vírgula (ASI)
+    return "\n".join(lines)
+
+
+def minify_html(html):
+    # <style> e <script> são minificados à parte e protegidos do resto
+    blocks = []
+
+    def keep(text):
+        blocks.append(text)
+        return f"\x00{len(blocks) - 1}\x00"
+
+    html = re.sub(r"<style>(.*?)</style>", lambda m: keep(f"<style>{minify_css(m.group(1))}</style>"), html, flags=re.S)
+    html = re.sub(r"<script>(.*?)</script>", lambda m: keep(f"<script>{minify_js(m.group(1))}</script>"), html, flags=re.S)
+    html = re.sub(r"<!--.*?-->", "", html, flags=re.S)
+    html = re.sub(r"\s+", " ", html)
+    # Espaço ao redor de tags de bloco não aparece na página
+    html = re.sub(r"\s*(</?(?:html|head|body|meta|link|title|div|section|footer|header|form|ul|li|p|h[1-6])\b[^>]*>)\s*", r"\1", html)
+    return re.sub(r"\x00(\d+)\x00", lambda m: blocks[int(m.group(1))], html).strip()
+
+
+# Fontes
+
+def used_font_weights(html):
+    weights = {400}
+    weights.update(int(w) for w in re.findall(r"font-weight:\s*(\d00)", html))
+    if re.search(r"<(strong|b|h[1-6])\b", html) or "font-weight: bold" in html:
+        weights.add(700)
+    return sorted(weights)
+
+
+def page_characters(html):
+    text = re.sub(r"<(style|script)>.*?</\1>", " ", html, flags=re.S)
+    text = unescape(re.sub(r"<[^>]+>", " ", text))  # &copy; -> ©
+    # Inclui textos dinâmicos do script (botão de envio, toast, máscara do telefone)
+    text += "".join(re.findall(r"['`](.*?)['`]", html))
+    return "".join(sorted(set(text) - set("\n\r\t")))
+
+
+def self_host_inter(html):
+    """Baixa a Inter já reduzida (pesos e caracteres usados) e retorna o CSS."""
+    weights = ";".join(str(w) for w in used_font_weights(html))
+    params = urllib.parse.urlencode({
+        "family": f"Inter:wght@{weights}",
+        "display": "swap",
+        "text": page_characters(html),
+    })
+    css = fetch(f"{GOOGLE_FONTS_CSS}?{params}").decode("utf-8")
+
+    preload = []
+    for url in sorted(set(re.findall(r"url\((https://[^)]+)\)", css))):
+        local = write_asset("inter", ".woff2", fetch(url))
+        css = css.replace(url, local)
+        preload.append(local)
+    return minify_css(css), preload
+
+
+def used_icons(html):
+    icons = {}
+    for style, name in re.findall(r"\b(fas|fab) fa-([a-z0-9-]+)", html):
+        icons.setdefault(style, set()).add(name)
+    return icons
+
+
+def subset_font(data, codepoints):
+    """Reduz a fonte aos codepoints informados (quando o fontTools está instalado)."""
+    if font_subset is None:
+        return data, ".woff2"
+
+    import io
+    options = font_subset.Options()
+    options.flavor = "woff2" if brotli else "woff"
+    options.layout_features = ["*"]
+    font = font_subset.load_font(io.BytesIO(data), options)
+    subsetter = font_subset.Subsetter(options)
+    subsetter.populate(unicodes=codepoints)
+    subsetter.subset(font)
+    out = io.BytesIO()
+    font_subset.save_font(font, out, options)
+    return out.getvalue(), f".{options.flavor}"
+
+
+def self_host_font_awesome(html):
+    """Gera o CSS só com os ícones usados e fontes reduzidas a esses glifos."""
+    icons = used_icons(html)
+    full_css = fetch(f"{FONT_AWESOME_BASE}/css/all.min.css").decode("utf-8")
+
+    css = [".fas,.fab{-webkit-font-smoothing:antialiased;display:inline-block;font-style:normal;"
+           "font-variant:normal;line-height:1;text-rendering:auto}"]
+    for style, names in sorted(icons.items()):
+        font_file, family, weight = FONT_AWESOME_STYLES[style]
+        codepoints = {}
+        for name in sorted(names):
+            match = re.search(r"\.fa-%s(?::{1,2}before)?\{(?:content|--fa):\"\\([0-9a-f]+)\"" % re.escape(name), full_css)
+            if not match:
+                print(f"Aviso: ícone fa-{name} não encontrado no Font Awesome", file=sys.stderr)
+                continue
+            codepoints[name] = match.group(1)
+
+        data, ext = subset_font(
+            fetch(f"{FONT_AWESOME_BASE}/webfonts/{font_file}.woff2"),
+            [int(cp, 16) for cp in codepoints.values()]
+        )
+        url = write_asset(font_file, ext, data)
+        css.append(f"@font-face{{font-family:\"{family}\";font-style:normal;font-weight:{weight};"
+                   f"font-display:block;src:url({url}) format(\"{ext[1:]}\")}}")
+        css.append(f".{style}{{font-family:\"{family}\";font-weight:{weight}}}")
+        css += [f".fa-{name}:before{{content:\"\\{cp}\"}}" for name, cp in sorted(codepoints.items())]
+    return "".join(css)
+
+
+# Build
+
+def build():
+    with open(SOURCE, encoding="utf-8") as f:
+        html = f.read()
+
+    shutil.rmtree(DIST, ignore_errors=True)
+    os.makedirs(ASSETS)
+    if font_subset is None:
+        print("Aviso: fontTools não instalado; o Font Awesome vai completo, sem subset "
+              "(pip install -r requirements-build.txt)", file=sys.stderr)
+    elif brotli is None:
+        print("Aviso: brotli não instalado; os ícones saem em woff em vez de woff2", file=sys.stderr)
+
+    font_links = re.compile(r"\s*<link[^>]+(fonts\.googleapis\.com|font-awesome)[^>]*>")
+    try:
+        inter_css, preload = self_host_inter(html)
+        icons_css = self_host_font_awesome(html)
+    except (OSError, ValueError) as e:
+        # Sem rede: mantém as fontes nas CDNs, só com os pesos usados e sem bloquear a renderização
+        print(f"Aviso: fontes não auto-hospedadas ({e})", file=sys.stderr)
+        weights = ";".join(str(w) for w in used_font_weights(html))
+        html = re.sub(r"Inter:wght@[\d;]+", f"Inter:wght@{weights}", html)
+        html = re.sub(r'<link rel="stylesheet" (href="[^"]*font-awesome[^"]*")>',
+                      r"""<link rel="stylesheet" \1 media="print" onload="this.media='all'">""", html)
+    else:
+        head = "".join(f'<link rel="preload" href="{url}" as="font" type="font/woff2" crossorigin>'
+                       for url in preload[:1])
+        head += f"<style>{inter_css}{icons_css}</style>"
+        html = font_links.sub("", html)
+        html = html.replace("<style>", head + "<style>", 1)
+
+    html = minify_html(html)
+    with open(os.path.join(DIST, "index.html"), "w", encoding="utf-8") as f:
+        f.write(html)
+
+    original = os.path.getsize(SOURCE)
+    print(f"dist/index.html: {original} -> {len(html.encode('utf-8'))} bytes")
+
+
+if __name__ == "__main__":
+    build()
@@ -0,0 +1,204 @@
+"""Stand-ins em memória para todos os serviços externos (Upstash, Telegram, Travelpayouts).
+
+Cada requisição feita via `urllib.request.urlopen` é atendida localmente e
+contabilizada por serviço (idas e bytes trafegados), para que os testes possam
+medir o custo de cada passo das conversas do bot.
+"""
+import fnmatch
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import pytest
+
+import api.storage as storage
+import api.webhook as webhook
+
+FAKE_UPSTASH_URL = "https://upstash.test"
+FAKE_TELEGRAM_HOST = "api.telegram.org"
+FAKE_TRAVELPAYOUTS_HOST = "api.travelpayouts.com"
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.body = json.dumps(payload).encode('utf-8')
+
+    def read(self):
+        return self.body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Upstreams:
+    """Simula os serviços externos e conta as idas a cada um."""
+
+    def __init__(self):
+        self.store = {}
+        self.expiring = {}
+        self.routes_with_data = set()
+        self.calls = []
+        self.next_message_id = 1
+        self.buttons = []
+        self.failing = set()
+
+    # Contabilização
+
+    def snapshot(self):
+        return len(self.calls)
+
+    def usage_since(self, mark):
+        usage = {"redis": 0, "telegram": 0, "travelpayouts": 0, "bytes": 0}
+        for service, size in self.calls[mark:]:
+            usage[service] += 1
+            usage["bytes"] += size
+        return usage
+
+    # Despacho
+
+    def urlopen(self, req, timeout=None):
+        url = req.full_url if isinstance(req, urllib.request.Request) else req
+        body = req.data if isinstance(req, urllib.request.Request) else None
+
+        if url.startswith(FAKE_UPSTASH_URL):
+            service, payload = "redis", self.handle_redis(url, body)
+        elif FAKE_TELEGRAM_HOST in url:
+            service, payload = "telegram", self.handle_telegram(url, body)
+        elif FAKE_TRAVELPAYOUTS_HOST in url:
+            service, payload = "travelpayouts", self.handle_travelpayouts(url)
+        else:
+            raise AssertionError(f"Requisição inesperada: {url}")
+
+        response = FakeResponse(payload)
+        self.calls.append((service, len(url) + len(body or b"") + len(response.body)))
+        return response
+
+    # Upstash
+
+    def run_command(self, args):
+        name, args = args[0].upper(), args[1:]
+        if name in self.failing:
+            raise urllib.error.URLError(f"{name} indisponível")
+        if name == "GET":
+            return self.store.get(args[0])
+        if name == "SET":
+            self.store[args[0]] = args[1]
+            if len(args) > 2 and args[2].upper() == "EX":
+                self.expiring[args[0]] = int(args[3])
+            return "OK"
+        if name == "DEL":
+            return sum(1 for key in args if self.store.pop(key, None) is not None)
+        if name == "MGET":
+            return [self.store.get(key) for key in args]
+        if name == "SCAN":
+            return ["0", sorted(k for k in self.store if fnmatch.fnmatchcase(k, args[2]))]
+        if name == "INCR":
+            self.store[args[0]] = str(int(self.store.get(args[0]) or 0) + 1)
+            return int(self.store[args[0]])
+        if name == "EXPIRE":
+            if args[0] not in self.expiring:
+                self.expiring[args[0]] = int(args[1])
+            return 1
+        if name == "RPUSH":
+            self.store.setdefault(args[0], []).extend(args[1:])
+            return len(self.store[args[0]])
+        if name == "LPOP":
+            items = self.store.get(args[0]) or []
+            popped, self.store[args[0]] = items[:int(args[1])], items[int(args[1]):]
+            return popped
+        raise AssertionError(f"Comando Redis não suportado: {name}")
+
+    def handle_redis(self, url, body):
+        path = url[len(FAKE_UPSTASH_URL):]
+        if path == "/pipeline":
+            return [{"result": self.run_command(cmd)} for cmd in json.loads(body)]
+        if body:
+            return {"result": self.run_command(json.loads(body))}
+        return {"result": self.run_command([urllib.parse.unquote(p) for p in path.strip("/").split("/")])}
+
+    # Telegram
+
+    def button(self, label):
+        """callback_data do botão da última mensagem cujo texto começa com `label`."""
+        for button in self.buttons:
+            if button["text"].startswith(label):
+                return button["callback_data"]
+        raise AssertionError(f"Botão '{label}' não encontrado: {[b['text'] for b in self.buttons]}")
+
+    def handle_telegram(self, url, body):
+        self.last_body = body
+        markup = json.loads(body or b"{}").get("reply_markup")
+        if markup:
+            # Botões da última mensagem, para os testes "clicarem" neles
+            self.buttons = [b for row in json.loads(markup)["inline_keyboard"] for b in row]
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        return {"ok": True, "result": {"message_id": message_id}}
+
+    # Travelpayouts
+
+    def handle_travelpayouts(self, url):
+        parsed = urllib.parse.urlparse(url)
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        route = (params.get("origin"), params.get("destination"))
+
+        if parsed.path == "/aviasales/v3/prices_for_dates":
+            if route not in self.routes_with_data:
+                return {"success": True, "data": []}
+            one_way = params.get("one_way") == "true"
+            return {"success": True, "data": [
+                {"price": (200 if one_way else 400) + 50 * i, "airline": "G3", "transfers": i % 2,
+                 "origin_airport": route[0], "destination_airport": route[1],
+                 "departure_at": f"{params['departure_at']}T08:00:00-03:00",
+                 "return_at": f"{params['return_at']}T18:00:00-03:00" if params.get("return_at") else ""}
+                for i in range(10)
+            ]}
+
+        if parsed.path == "/v1/prices/cheap":
+            if route not in self.routes_with_data:
+                return {"success": True, "data": {}}
+            return {"success": True, "data": {route[1]: {
+                str(i): {"price": 500 + 25 * i, "airline": "LA", "transfers": 0,
+                         "departure_date": "2030-01-10", "return_date": ""}
+                for i in range(3)
+            }}}
+
+        if parsed.path == "/v2/prices/latest":
+            return {"success": True, "data": [
+                {"destination": code, "value": 300 + 10 * i}
+                for i, code in enumerate(["SSA", "REC", "FOR", "POA", "XXX", "CWB"])
+            ]}
+
+        raise AssertionError(f"Endpoint Travelpayouts inesperado: {parsed.path}")
+
+
+def monitor(origin="GRU", destination="GIG", max_price=None, adults=1, chat_id=1, **extra):
+    """Monitoramento como o webhook grava em monitors:<user_id>."""
+    return dict({
+        "origin": origin, "origin_name": origin,
+        "destination": destination, "destination_name": destination,
+        "departure_date": "2099-01-10", "return_date": None,
+        "adults": adults, "max_price": max_price, "chat_id": chat_id,
+    }, **extra)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """Armazenamento em memória no lugar do Upstash."""
+    memory = storage.MemoryStorage()
+    monkeypatch.setattr(storage, "_storage", memory)
+    return memory
+
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    fake = Upstreams()
+    monkeypatch.setattr(urllib.request, "urlopen", fake.urlopen)
+    monkeypatch.setattr(storage, "_storage", storage.UpstashStorage(FAKE_UPSTASH_URL, "test-token"))
+    monkeypatch.setattr(webhook, "TELEGRAM_TOKEN", "test-bot")
+    monkeypatch.setattr(webhook, "TRAVELPAYOUTS_TOKEN", "test-tp")
+    return fake
@@ -0,0 +1,31 @@
+import json
+
+import api.admin as admin
+
+
+def export(cursor=None, scopes=("monitors", "state")):
+    return [json.loads(line) for chunk in admin.export_chunks(list(scopes), cursor) for line in chunk.splitlines()]
+
+
+def test_export_includes_keys_and_final_cursor(upstreams):
+    upstreams.store["monitors:1"] = json.dumps([{"origin": "GRU"}])
+    upstreams.store["state:1"] = json.dumps(None)
+
+    lines = export()
+
+    assert [(line["key"], line["value"]) for line in lines[:-1]] == [
+        ("monitors:1", [{"origin": "GRU"}]), ("state:1", None)]
+    assert lines[-1] == {"cursor": None, "done": True}
+
+
+def test_failed_mget_stops_with_resumable_cursor(upstreams):
+    upstreams.store["monitors:1"] = json.dumps([{"origin": "GRU"}])
+    upstreams.failing.add("MGET")
+
+    lines = export()
+
+    assert len(lines) == 1 and "error" in lines[0]
+    assert lines[0]["cursor"] == "monitors:0"
+
+    upstreams.failing.clear()
+    assert export(lines[0]["cursor"])[0]["value"] == [{"origin": "GRU"}]
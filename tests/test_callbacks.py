@@ -0,0 +1,88 @@
+import json
+
+import api.webhook as webhook
+
+from test_roundtrip_budget import FLOWS, USER_ID, run_flow, tap, text
+
+TRIP = {
+    "mode": "search", "origin": "GRU", "origin_name": "São Paulo - Aeroporto de Guarulhos",
+    "destination": "GIG", "destination_name": "Rio de Janeiro - Aeroporto do Galeão",
+    "departure_date": "2030-01-10", "return_date": "2030-01-17", "adults": 2, "max_price": 1234.5,
+}
+
+
+def test_trip_token_round_trip_fits_callback_data(upstreams):
+    token = webhook.encode_trip(USER_ID, TRIP)
+
+    assert webhook.decode_trip(USER_ID, token) == TRIP
+    assert len(f"confirm_monitor:{token}".encode()) <= 64
+
+
+def test_trip_token_is_bound_to_user_and_signed(upstreams):
+    token = webhook.encode_trip(USER_ID, TRIP)
+    tampered = ("A" if token[0] != "A" else "B") + token[1:]
+
+    assert webhook.decode_trip(USER_ID + 1, token) is None
+    assert webhook.decode_trip(USER_ID, tampered) is None
+    assert webhook.decode_trip(USER_ID, "lixo") is None
+
+
+def test_one_way_trip_keeps_missing_fields_empty(upstreams):
+    data = webhook.decode_trip(USER_ID, webhook.encode_trip(USER_ID, {"origin": "REC"}))
+    assert data == {"origin": "REC", "origin_name": "Recife - Aeroporto do Recife", "return_date": None}
+
+
+def test_far_future_date_is_rejected_with_a_reply(upstreams):
+    # 2180 não cabe no token dos botões; a data é recusada antes de codificá-lo
+    run_flow(upstreams, FLOWS["search_no_results_retry"][:5] + [("far", text("10/01/2180"))])
+
+    assert "até 1 ano" in json.loads(upstreams.last_body)["text"]
+    assert json.loads(upstreams.store[f"state:{USER_ID}"])["state"] == "search_departure_date"
+
+
+def test_unknown_or_legacy_callback_asks_to_restart(upstreams):
+    run_flow(upstreams, [("legacy", tap("sorigin_GRU"))])
+    assert [b["callback_data"] for b in upstreams.buttons] == ["main_menu"]
+
+
+def test_retry_after_no_results_keeps_route(upstreams):
+    steps = FLOWS["search_no_results_retry"]
+    run_flow(upstreams, steps[:-1])
+
+    state = json.loads(upstreams.store[f"state:{USER_ID}"])
+    assert state["state"] == "search_departure_date"
+    assert (state["data"]["origin"], state["data"]["destination"]) == ("NAT", "NRT")
+
+
+def test_replayed_confirm_does_not_duplicate_monitor(upstreams):
+    steps = FLOWS["monitor_without_data"]
+    run_flow(upstreams, steps[:-1])
+    confirm = upstreams.button("Criar mesmo assim")
+
+    run_flow(upstreams, [("first", tap(confirm)), ("replay", tap(confirm))])
+
+    monitors = json.loads(upstreams.store[f"monitors:{USER_ID}"])
+    assert [(m["origin"], m["destination"]) for m in monitors] == [("NAT", "NRT")]
+
+
+def test_replayed_skip_max_price_does_not_duplicate_monitor(upstreams):
+    upstreams.routes_with_data.add(("GRU", "GIG"))
+    steps = FLOWS["monitor_with_data"]
+    run_flow(upstreams, steps[:-1])
+    skip = upstreams.button("Pular")
+
+    run_flow(upstreams, [("first", tap(skip)), ("replay", tap(skip))])
+
+    assert len(json.loads(upstreams.store[f"monitors:{USER_ID}"])) == 1
+
+
+def test_paging_an_older_search_shows_its_own_results(upstreams):
+    upstreams.routes_with_data.update({("GRU", "GIG"), ("REC", "SSA")})
+    run_flow(upstreams, FLOWS["search_round_trip"][:8])
+    older_page = upstreams.button("Mais resultados")
+    run_flow(upstreams, FLOWS["search_one_way"])
+
+    run_flow(upstreams, [("older", tap(older_page))])
+
+    edited = json.loads(upstreams.last_body)
+    assert edited["text"].startswith("*Voos: São Paulo")
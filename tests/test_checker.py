@@ -0,0 +1,108 @@
+import pytest
+
+import api.checker as checker
+import api.quota as quota
+
+from conftest import monitor
+
+
+@pytest.fixture(params=["numpy", "array"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(checker, "np", None)
+    return request.param
+
+
+PRICES = {"GRU:GIG:2099-01-10:": 400.0, "REC:SSA:2099-01-10:": 300.0}
+
+
+def test_table_groups_monitors_by_route(store):
+    store.set("monitors:1", [monitor("GRU", "GIG"), monitor("REC", "SSA")])
+    store.set("monitors:2", [monitor("GRU", "GIG", chat_id=2)])
+
+    table = checker.MonitorTable.load()
+
+    assert len(table) == 3
+    assert sorted(table.routes) == sorted(PRICES)
+    assert table.route_ids[0] == table.route_ids[2]
+
+
+def test_triggered_alerts(store, backend):
+    store.set("monitors:1", [
+        monitor("GRU", "GIG", max_price=500),                 # 400 < 500: alerta
+        monitor("GRU", "GIG", max_price=700, adults=2),       # 800 > 700: não
+        monitor("REC", "SSA"),                                # sem limite: alerta
+        monitor("REC", "SSA", last_notified_price=300.0),     # não baixou: não
+        monitor("POA", "CWB"),                                # sem preço: não
+    ])
+    table = checker.MonitorTable.load()
+    route_prices = [PRICES.get(key, checker.NO_PRICE) for key in table.routes]
+
+    hits, totals = checker.triggered_alerts(table, checker.array('d', route_prices))
+
+    assert hits == [0, 2]
+    assert float(totals[1]) == 800.0
+
+
+def test_check_cycle_publishes_route_events(store, backend, monkeypatch):
+    monkeypatch.setattr(checker, "fetch_route_price", lambda key: PRICES.get(key, checker.NO_PRICE))
+    store.set("monitors:1", [monitor("GRU", "GIG", max_price=500), monitor("REC", "SSA", max_price=100)])
+    store.set("monitors:2", [monitor("GRU", "GIG", chat_id=2)])
+
+    assert checker.check_monitors() == {
+        "monitors": 3, "routes": 2, "priced": 2, "alerts": 2, "events": 1, "done": True,
+    }
+
+    [(_, event)] = store.xrange(checker.PRICE_EVENTS_STREAM)
+    assert event["route"] == "GRU:GIG:2099-01-10:"
+    assert float(event["price"]) == 400.0
+    assert event["users"] == "[1, 2]"
+
+
+def test_last_notified_price_comes_from_notified_key(store, backend):
+    store.set("monitors:1", [monitor("GRU", "GIG"), monitor("GRU", "GIG", adults=2)])
+    store.set("notified:1", {"GRU:GIG:2099-01-10::1": 400.0})
+    table = checker.MonitorTable.load()
+
+    hits, _ = checker.triggered_alerts(table, checker.array('d', [400.0]))
+
+    assert hits == [1]
+
+
+def test_check_cycle_resumes_from_cursor(store, backend, monkeypatch):
+    monkeypatch.setattr(checker, "fetch_route_price", lambda key: PRICES.get(key, checker.NO_PRICE))
+    monkeypatch.setattr(checker, "PRICE_FETCH_WORKERS", 1)
+    store.set("monitors:1", [monitor("GRU", "GIG", max_price=500), monitor("REC", "SSA")])
+    expired = checker.time.monotonic()
+
+    first = checker.check_monitors(deadline=expired)
+    assert (first["priced"], first["events"], first["done"]) == (1, 1, False)
+    assert store.get(checker.CURSOR_KEY) == "GRU:GIG:2099-01-10:"
+
+    second = checker.check_monitors(deadline=expired)
+    assert (second["priced"], second["events"], second["done"]) == (1, 1, True)
+    assert [e["route"] for _, e in store.xrange(checker.PRICE_EVENTS_STREAM)] == sorted(PRICES)
+
+    # Ciclo completo: as próximas execuções esperam o intervalo
+    assert checker.check_monitors() == {"skipped": True}
+
+
+def test_check_cycle_stops_when_quota_runs_out(upstreams, store, monkeypatch):
+    monkeypatch.setattr(quota, "QUOTA_LIMIT", 10)
+    dates = [f"2099-{month:02d}-{day}" for month in range(1, 5) for day in range(10, 20)]
+    store.set("monitors:1", [monitor("GRU", "GIG", departure_date=date) for date in dates])
+
+    first = checker.check_monitors()
+
+    # 7 chamadas (parte do cron) e nenhuma rota dada como verificada sem preço
+    assert upstreams.usage_since(0)["travelpayouts"] == 7
+    assert not first["done"] and first["priced"] <= 7
+    last_priced = f"GRU:GIG:{dates[first['priced'] - 1]}:" if first["priced"] else None
+    assert store.get(checker.CURSOR_KEY) == last_priced
+    assert not store.get(checker.IDLE_KEY)
+
+    monkeypatch.setattr(quota, "QUOTA_LIMIT", 1000)
+    second = checker.check_monitors()
+    assert second["done"] and first["priced"] + second["priced"] == 40
@@ -0,0 +1,54 @@
+import pytest
+
+import api.leads as leads
+import api.storage as storage
+
+
+pytestmark = pytest.mark.usefixtures("store")
+
+
+def test_ip_limit_rejects_with_retry_after():
+    results = [leads.check_rate_limit("10.0.0.1", "11999990000") for _ in range(6)]
+
+    assert [retry for retry, _ in results[:5]] == [0] * 5
+    retry_after, _ = results[5]
+    assert 1 <= retry_after <= 60
+
+
+def test_ip_limit_is_per_ip():
+    for _ in range(5):
+        leads.check_rate_limit("10.0.0.1", "11999990000")
+    assert leads.check_rate_limit("10.0.0.2", "11999990000") == (0, False)
+
+
+def test_global_limit(monkeypatch):
+    monkeypatch.setattr(leads, "GLOBAL_RATE_LIMIT", (3, 60))
+    results = [leads.check_rate_limit(f"10.0.1.{i}", "11999990000")[0] for i in range(4)]
+    assert results[:3] == [0, 0, 0] and results[3] > 0
+
+
+def test_blocked_ip_does_not_fill_global_window(monkeypatch):
+    monkeypatch.setattr(leads, "GLOBAL_RATE_LIMIT", (10, 60))
+    for _ in range(300):
+        leads.check_rate_limit("6.6.6.6", "11999990000")
+
+    assert leads.check_rate_limit("10.0.0.1", "11999990000") == (0, False)
+    # Só os acessos aceitos ficam guardados
+    assert len(storage.get_storage().entry("ratelimit:leads:ip:6.6.6.6:60", "zset")[0]) == 5
+
+
+def test_recent_number_is_reported_as_seen():
+    storage.get_storage().set("leads:seen:11999990000", True)
+    assert leads.check_rate_limit("10.0.0.1", "11999990000") == (0, True)
+
+
+def test_client_that_obeys_retry_after_is_accepted(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(leads.time, "time", lambda: clock[0])
+    for i in range(6):
+        clock[0] = 1000.0 + i
+        retry_after, _ = leads.check_rate_limit("10.0.0.1", "11999990000")
+
+    assert retry_after == 55
+    clock[0] += retry_after
+    assert leads.check_rate_limit("10.0.0.1", "11999990000") == (0, False)
@@ -0,0 +1,173 @@
+import pytest
+
+import api.checker as checker
+import api.notifier as notifier
+
+from conftest import monitor
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.sent = []
+        self.up = True
+
+    def send_message(self, chat_id, text):
+        if self.up:
+            self.sent.append(chat_id)
+        return self.up
+
+
+@pytest.fixture
+def telegram(monkeypatch):
+    fake = FakeTelegram()
+    monkeypatch.setattr(notifier, "send_message", fake.send_message)
+    return fake
+
+
+def publish(store, price=400.0, users="[1, 2]"):
+    return store.xadd(checker.PRICE_EVENTS_STREAM, {
+        "route": "GRU:GIG:2099-01-10:", "price": price, "users": users,
+    })
+
+
+def pending(store):
+    return store.stream(checker.PRICE_EVENTS_STREAM)["groups"][notifier.NOTIFIER_GROUP]["pending"]
+
+
+def test_event_fans_out_to_subscribers_and_is_acked(store, telegram):
+    store.set("monitors:1", [monitor(max_price=500, chat_id=10)])
+    store.set("monitors:2", [monitor(max_price=300, chat_id=20), monitor(chat_id=21)])
+    publish(store)
+
+    stats = notifier.process_events("worker-1")
+
+    assert stats == {"claimed": 0, "read": 1, "acked": 1}
+    assert telegram.sent == [10, 21]
+    assert not pending(store)
+    assert store.get("notified:1") == {"GRU:GIG:2099-01-10::1": 400.0}
+
+
+def test_delivery_does_not_overwrite_monitor_changes(store, telegram, monkeypatch):
+    store.set("monitors:1", [monitor(chat_id=10), monitor(chat_id=10, destination="SSA")])
+    publish(store, users="[1]")
+
+    def delete_while_sending(chat_id, text):
+        # Usuário exclui um monitor pelo webhook enquanto o alerta é enviado
+        store.set("monitors:1", store.get("monitors:1")[1:])
+        return True
+
+    monkeypatch.setattr(notifier, "send_message", delete_while_sending)
+    notifier.process_events("worker-1")
+
+    assert [m["destination"] for m in store.get("monitors:1")] == ["SSA"]
+    assert store.get("notified:1") == {"GRU:GIG:2099-01-10::1": 400.0}
+
+
+def test_failed_delivery_stays_pending_and_is_reclaimed(store, telegram, monkeypatch):
+    store.set("monitors:1", [monitor(chat_id=10)])
+    publish(store, users="[1]")
+
+    telegram.up = False
+    assert notifier.process_events("worker-1")["acked"] == 0
+    assert list(pending(store).values())[0][0] == "worker-1"
+
+    # Outro consumidor assume o evento parado
+    telegram.up = True
+    monkeypatch.setattr(notifier, "CLAIM_MIN_IDLE", 0)
+    assert notifier.process_events("worker-2") == {"claimed": 1, "read": 0, "acked": 1}
+    assert telegram.sent == [10]
+
+
+def test_replayed_event_does_not_notify_twice(store, telegram):
+    store.set("monitors:1", [monitor(chat_id=10)])
+    entry_id = publish(store, users="[1]")
+    notifier.process_events("worker-1")
+
+    [(replayed_id, fields)] = store.xrange(checker.PRICE_EVENTS_STREAM)
+    assert replayed_id == entry_id
+    assert notifier.deliver_event(fields) == (0, 0)
+    assert telegram.sent == [10]
+
+
+def test_gives_up_after_max_attempts(store, telegram, monkeypatch):
+    store.set("monitors:1", [monitor(chat_id=10)])
+    publish(store, users="[1]")
+    telegram.up = False
+    monkeypatch.setattr(notifier, "CLAIM_MIN_IDLE", 0)
+
+    for _ in range(notifier.MAX_ATTEMPTS):
+        notifier.process_events("worker-1")
+    assert not pending(store)
+
+
+def test_failed_attempt_counter_keeps_event_pending(store, telegram, monkeypatch):
+    store.set("monitors:1", [monitor(chat_id=10)])
+    publish(store, users="[1]")
+    telegram.up = False
+    monkeypatch.setattr(store, "incr", lambda key, ex=None: None)
+
+    assert notifier.process_events("worker-1")["acked"] == 0
+    assert pending(store)
+
+
+def test_digest_mode_queues_instead_of_sending(store, telegram):
+    store.set("prefs:1", {"digest": "hourly"})
+    store.set("monitors:1", [monitor(chat_id=10)])
+    publish(store, users="[1]")
+
+    assert notifier.process_events("worker-1")["acked"] == 1
+    assert telegram.sent == []
+    assert store.smembers("digest:pending:hourly") == ["10"]
+    assert store.get("notified:1") == {"GRU:GIG:2099-01-10::1": 400.0}
+
+
+def test_flush_merges_changes_into_one_message(store, telegram, monkeypatch):
+    texts = []
+    monkeypatch.setattr(notifier, "send_message", lambda chat_id, text: texts.append((chat_id, text)) or True)
+    store.set("prefs:1", {"digest": "daily"})
+    store.set("monitors:1", [monitor(chat_id=10), monitor(chat_id=10, destination="SSA", destination_name="Salvador")])
+    for price in (400.0, 350.0):
+        publish(store, price=price, users="[1]")
+    store.xadd(checker.PRICE_EVENTS_STREAM, {"route": "GRU:SSA:2099-01-10:", "price": 600.0, "users": "[1]"})
+    notifier.process_events("worker-1")
+
+    assert notifier.flush_digests("daily") == {"chats": 1, "alerts": 3, "failed": 0}
+    [(chat_id, text)] = texts
+    assert chat_id == "10"
+    assert "(2 rota(s))" in text
+    # Duas mudanças na mesma rota viram uma linha com o preço mais recente
+    assert "Agora: *R$ 350,00*" in text and "R$ 400,00" not in text
+    assert text.index("R$ 350,00") < text.index("Salvador")
+    assert store.lrange("digest:daily:10") == []
+    assert notifier.flush_digests("daily")["chats"] == 0
+
+
+def test_failed_flush_keeps_alerts_for_next_window(store, telegram):
+    store.set("prefs:1", {"digest": "hourly"})
+    store.set("monitors:1", [monitor(chat_id=10)])
+    publish(store, users="[1]")
+    notifier.process_events("worker-1")
+
+    telegram.up = False
+    assert notifier.flush_digests("hourly")["failed"] == 1
+    telegram.up = True
+    assert notifier.flush_digests("hourly") == {"chats": 1, "alerts": 1, "failed": 0}
+    assert telegram.sent == ["10"]
+
+
+def test_switching_mode_keeps_queues_apart(store, telegram, monkeypatch):
+    texts = []
+    monkeypatch.setattr(notifier, "send_message", lambda chat_id, text: texts.append(text) or True)
+    store.set("monitors:1", [monitor(chat_id=10)])
+    store.set("prefs:1", {"digest": "hourly"})
+    publish(store, price=400.0, users="[1]")
+    notifier.process_events("worker-1")
+    store.set("prefs:1", {"digest": "daily"})
+    publish(store, price=350.0, users="[1]")
+    notifier.process_events("worker-1")
+
+    # O resumo por hora leva só o que chegou enquanto o usuário estava nele
+    assert notifier.flush_digests("hourly") == {"chats": 1, "alerts": 1, "failed": 0}
+    assert "R$ 400,00" in texts[0] and "R$ 350,00" not in texts[0]
+    assert store.lrange("digest:daily:10")[0]["total"] == 350.0
+    assert notifier.flush_digests("daily")["alerts"] == 1
@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+import api.quota as quota
+import api.storage as storage
+import api.webhook as webhook
+
+ROUTE = ("GRU", "GIG")
+PATH = "/aviasales/v3/prices_for_dates"
+PARAMS = {"origin": "GRU", "destination": "GIG", "departure_at": "2030-01-10", "currency": "brl",
+          "sorting": "price", "limit": webhook.SEARCH_RESULTS_LIMIT}
+
+
+@pytest.fixture
+def api(upstreams, store, monkeypatch):
+    monkeypatch.setattr(quota, "QUOTA_LIMIT", 10)
+    upstreams.routes_with_data.add(ROUTE)
+    return upstreams
+
+
+def travelpayouts_calls(upstreams):
+    return upstreams.usage_since(0)["travelpayouts"]
+
+
+def use_quota(calls):
+    for _ in range(calls):
+        quota.acquire(quota.INTERACTIVE)
+
+
+def age_cache(seconds):
+    key = quota.cache_key(PATH, PARAMS)
+    entry = storage.get_storage().get(key)
+    entry["at"] -= seconds
+    storage.get_storage().set(key, entry)
+
+
+def test_fresh_cache_avoids_second_call(api):
+    first = webhook.fetch_prices_for_dates("GRU", "GIG", "2030-01-10")
+    second = webhook.fetch_prices_for_dates("GRU", "GIG", "2030-01-10")
+
+    assert first == second and first
+    assert travelpayouts_calls(api) == 1
+
+
+def test_background_leaves_reserve_for_interactive(api):
+    # 7 de 10 chamadas: a parte do cron acabou, a reserva interativa não
+    use_quota(7)
+
+    with pytest.raises(quota.QuotaExhausted):
+        webhook.fetch_prices_for_dates("GRU", "GIG", "2030-01-10", priority=quota.BACKGROUND)
+    assert webhook.fetch_prices_for_dates("GRU", "GIG", "2030-01-10")
+    assert travelpayouts_calls(api) == 1
+
+
+def test_rejected_background_calls_do_not_use_the_reserve(api):
+    results = [quota.acquire(quota.BACKGROUND) for _ in range(30)]
+
+    assert results.count(True) == 7
+    assert quota.acquire(quota.INTERACTIVE)
+    assert webhook.fetch_prices_for_dates("GRU", "GIG", "2030-01-10")
+
+
+def test_near_limit_serves_stale_and_schedules_refresh(api):
+    webhook.fetch_prices_for_dates("GRU", "GIG", "2030-01-10")
+    age_cache(2 * 3600)
+    use_quota(8)
+
+    flights = webhook.fetch_prices_for_dates("GRU", "GIG", "2030-01-10")
+
+    assert flights and time.time() - flights[0]["cached_at"] >= 2 * 3600
+    assert travelpayouts_calls(api) == 1
+    webhook.fetch_prices_for_dates("GRU", "GIG", "2030-01-10")
+    # Vários acessos à resposta velha agendam uma única atualização
+    assert quota.pending_refreshes(10) == [{"path": PATH, "params": PARAMS}]
+
+
+def test_stale_results_are_labelled():
+    results = {"id": "abc", "title": "GRU → GIG", "rows": [[500.0, "G3", 0, "2030-01-10", ""]],
+               "cached_at": time.time() - 3 * 3600}
+
+    text, _ = webhook.render_results(results)
+
+    assert "Preços de 3 h atrás (atualizando)" in text
+
+
+def test_refresh_job_updates_scheduled_entries(api):
+    webhook.fetch_prices_for_dates("GRU", "GIG", "2030-01-10")
+    age_cache(2 * 3600)
+    quota.schedule_refresh(PATH, PARAMS)
+    quota.schedule_refresh(PATH, PARAMS)
+
+    assert webhook.refresh_stale_prices() == 1
+    assert travelpayouts_calls(api) == 2
+    assert time.time() - storage.get_storage().get(quota.cache_key(PATH, PARAMS))["at"] < 60
+    assert quota.pending_refreshes(10) == []
+
+
+def test_refresh_job_keeps_entries_when_quota_runs_out(api):
+    use_quota(7)
+    quota.schedule_refresh(PATH, PARAMS)
+
+    assert webhook.refresh_stale_prices() == 0
+    assert quota.pending_refreshes(10) == [{"path": PATH, "params": PARAMS}]
@@ -0,0 +1,52 @@
+from itertools import product
+
+from api.webhook import cheapest_leg_pairs, legs_connect
+
+
+def leg(price, origin, destination, origin_city=None, destination_city=None):
+    return {
+        "price": price,
+        "origin": origin_city or origin,
+        "destination": destination_city or destination,
+        "origin_airport": origin,
+        "destination_airport": destination,
+    }
+
+
+def test_pairs_come_out_cheapest_first():
+    outbound = [leg(p, "GRU", "GIG") for p in (300, 100, 250, 180)]
+    inbound = [leg(p, "GIG", "GRU") for p in (90, 400, 120)]
+
+    pairs = cheapest_leg_pairs(outbound, inbound, 5)
+
+    brute_force = sorted(o["price"] + i["price"] for o, i in product(outbound, inbound))[:5]
+    assert [o["price"] + i["price"] for o, i in pairs] == brute_force
+
+
+def test_same_airport_constraint_skips_open_jaw():
+    outbound = [leg(100, "GRU", "GIG", "SAO", "RIO")]
+    inbound = [leg(50, "SDU", "GRU", "RIO", "SAO"), leg(80, "GIG", "GRU", "RIO", "SAO")]
+
+    same_airport = cheapest_leg_pairs(outbound, inbound, 2, open_jaw=False)
+    open_jaw = cheapest_leg_pairs(outbound, inbound, 2, open_jaw=True)
+
+    assert [i["origin_airport"] for _, i in same_airport] == ["GIG"]
+    assert [i["origin_airport"] for _, i in open_jaw] == ["SDU", "GIG"]
+
+
+def test_connecting_outbound_beyond_first_k_is_found():
+    # A ida mais barata não conecta; a que conecta está fora das k primeiras
+    outbound = [leg(100, "GRU", "SDU", "SAO", "RIO"), leg(150, "GRU", "GIG", "SAO", "RIO")]
+    inbound = [leg(50, "GIG", "GRU", "RIO", "SAO")]
+
+    [(o, i)] = cheapest_leg_pairs(outbound, inbound, 1, open_jaw=False)
+
+    assert (o["price"], i["price"]) == (150, 50)
+
+
+def test_legs_from_other_cities_never_connect():
+    assert not legs_connect(leg(1, "GRU", "GIG", "SAO", "RIO"), leg(1, "BSB", "GRU", "BSB", "SAO"), open_jaw=True)
+
+
+def test_empty_side_returns_no_pairs():
+    assert cheapest_leg_pairs([leg(100, "GRU", "GIG")], [], 3) == []
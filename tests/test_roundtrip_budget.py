@@ -0,0 +1,240 @@
+"""Orçamento de idas a serviços externos por passo de cada conversa.
+
+Cada fluxo é executado contra os stand-ins de `conftest.py`; para cada passo
+contamos as chamadas a Redis, Telegram e Travelpayouts e os bytes trafegados,
+e comparamos com o orçamento registrado em `roundtrip_budgets.json`.
+
+Para regravar o orçamento depois de uma mudança intencional:
+
+    UPDATE_BUDGETS=1 python -m pytest tests/test_roundtrip_budget.py
+"""
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import api.webhook as webhook
+
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), "roundtrip_budgets.json")
+UPDATE_BUDGETS = os.environ.get("UPDATE_BUDGETS") == "1"
+
+USER_ID = 1001
+CHAT_ID = 1001
+
+DEPARTURE = (datetime.now() + timedelta(days=30)).strftime("%d/%m/%Y")
+RETURN = (datetime.now() + timedelta(days=37)).strftime("%d/%m/%Y")
+
+
+def text(value):
+    return {"message": {"chat": {"id": CHAT_ID}, "from": {"id": USER_ID}, "text": value}}
+
+
+def tap(data):
+    return {"callback_query": {
+        "id": "cb",
+        "from": {"id": USER_ID},
+        "message": {"message_id": 1, "chat": {"id": CHAT_ID}},
+        "data": data,
+    }}
+
+
+def press(label):
+    """Clica no botão da última mensagem (o callback_data carrega estado assinado)."""
+    return lambda upstreams: tap(upstreams.button(label))
+
+
+def dispatch(update):
+    if "message" in update:
+        webhook.handle_message(update["message"])
+    else:
+        webhook.handle_callback(update["callback_query"])
+
+
+FLOWS = {
+    "search_round_trip": [
+        ("start", text("/buscar")),
+        ("origin_text", text("São Paulo")),
+        ("origin_select", press("GRU")),
+        ("destination_text", text("Rio de Janeiro")),
+        ("destination_select", press("GIG")),
+        ("departure_date", text(DEPARTURE)),
+        ("return_date", text(RETURN)),
+        ("adults", press("2")),
+        ("more_results", press("Mais resultados")),
+        ("sort_by_stops", press("Menos paradas")),
+        ("filter_direct", press("Só diretos")),
+    ],
+    "search_one_way": [
+        ("start", tap("search_now")),
+        ("origin_text", text("Recife")),
+        ("origin_select", press("REC")),
+        ("destination_text", text("Salvador")),
+        ("destination_select", press("SSA")),
+        ("departure_date", text(DEPARTURE)),
+        ("skip_return", press("Só ida")),
+        ("adults", press("1")),
+    ],
+    "search_no_results_retry": [
+        ("start", tap("search_now")),
+        ("origin_text", text("Natal")),
+        ("origin_select", press("NAT")),
+        ("destination_text", text("Tóquio")),
+        ("destination_select", press("NRT")),
+        ("departure_date", text(DEPARTURE)),
+        ("skip_return", press("Só ida")),
+        ("adults", press("1")),
+        ("retry_dates", press("Tentar Outras Datas")),
+        ("departure_date_retry", text(DEPARTURE)),
+    ],
+    "search_airport_not_found": [
+        ("start", tap("search_now")),
+        ("origin_not_found", text("Atlântida")),
+        ("origin_text", text("Curitiba")),
+        ("origin_select", press("CWB")),
+        ("destination_not_found", text("Xanadu")),
+        ("retry_dest", press("Tentar Novamente")),
+    ],
+    "monitor_with_data": [
+        ("start", text("/monitorar")),
+        ("origin_text", text("São Paulo")),
+        ("origin_select", press("GRU")),
+        ("destination_text", text("Rio de Janeiro")),
+        ("destination_select", press("GIG")),
+        ("departure_date", text(DEPARTURE)),
+        ("skip_return", press("Só ida")),
+        ("adults", press("1")),
+        ("max_price", text("1500")),
+    ],
+    "monitor_without_data": [
+        ("start", tap("new_monitor")),
+        ("origin_not_found", text("Atlântida")),
+        ("retry_origin", press("Tentar Novamente")),
+        ("origin_text", text("Natal")),
+        ("origin_select", press("NAT")),
+        ("destination_text", text("Tóquio")),
+        ("destination_select", press("NRT")),
+        ("departure_date", text(DEPARTURE)),
+        ("return_date", text(RETURN)),
+        ("adults", press("3")),
+        ("skip_max_price", press("Pular")),
+        ("confirm_monitor", press("Criar mesmo assim")),
+    ],
+    "manage_monitors": [
+        ("menu", text("/menu")),
+        ("list", tap("my_monitors")),
+        ("delete", press("Excluir #1")),
+        ("list_after_delete", text("/meus")),
+    ],
+}
+
+ROUTES_WITH_DATA = {("GRU", "GIG"), ("GIG", "GRU"), ("REC", "SSA"), ("CWB", "GIG")}
+
+EXISTING_MONITORS = [{
+    "origin": "GRU", "origin_name": "São Paulo - Aeroporto de Guarulhos",
+    "destination": "GIG", "destination_name": "Rio de Janeiro - Aeroporto do Galeão",
+    "departure_date": "2030-01-10", "return_date": None, "adults": 1,
+    "max_price": 900.0, "chat_id": CHAT_ID, "created_at": "2030-01-01T00:00:00",
+}]
+
+
+ALTERNATIVES_NAT = [{"code": "REC", "city": "Recife", "price": 300}, {"code": "SSA", "city": "Salvador", "price": 310}]
+
+
+def load_budgets():
+    if not os.path.exists(BUDGETS_PATH):
+        return {}
+    with open(BUDGETS_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def run_flow(upstreams, steps):
+    usage = {}
+    for name, update in steps:
+        if callable(update):
+            update = update(upstreams)
+        mark = upstreams.snapshot()
+        dispatch(update)
+        usage[name] = upstreams.usage_since(mark)
+    return usage
+
+
+@pytest.fixture(scope="module")
+def recorded():
+    budgets = load_budgets()
+    yield budgets
+    if UPDATE_BUDGETS:
+        with open(BUDGETS_PATH, "w", encoding="utf-8") as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+@pytest.mark.parametrize("flow", sorted(FLOWS))
+def test_flow_within_budget(flow, upstreams, recorded):
+    upstreams.routes_with_data.update(ROUTES_WITH_DATA)
+    upstreams.store[f"monitors:{USER_ID}"] = json.dumps(EXISTING_MONITORS)
+    # Tabela de alternativas já calculada pelo cron diário
+    upstreams.store["alternatives:NAT"] = json.dumps(ALTERNATIVES_NAT)
+
+    usage = run_flow(upstreams, FLOWS[flow])
+
+    if UPDATE_BUDGETS:
+        recorded[flow] = usage
+        return
+
+    assert flow in recorded, f"Fluxo '{flow}' sem orçamento registrado (rode com UPDATE_BUDGETS=1)"
+    budget = recorded[flow]
+    assert set(usage) == set(budget), f"Passos de '{flow}' mudaram: {sorted(usage)} != {sorted(budget)}"
+
+    over = [
+        f"{step}.{metric}: {usage[step][metric]} > {limit}"
+        for step, limits in budget.items()
+        for metric, limit in limits.items()
+        if usage[step][metric] > limit
+    ]
+    assert not over, f"Fluxo '{flow}' excedeu o orçamento: " + "; ".join(over)
+
+
+def test_result_pages_come_from_stored_results(upstreams):
+    upstreams.routes_with_data.update(ROUTES_WITH_DATA)
+    steps = FLOWS["search_round_trip"]
+    run_flow(upstreams, steps[:-3])
+
+    usage = run_flow(upstreams, steps[-3:])
+    assert all(u["travelpayouts"] == 0 for u in usage.values())
+
+    [key] = [k for k in upstreams.store if k.startswith(f"results:{USER_ID}:")]
+    results = json.loads(upstreams.store[key])
+    # 10 tarifas ida+volta e as 30 combinações mais baratas de trechos só ida
+    assert len(results["rows"]) == 40
+    assert upstreams.expiring[key] == webhook.RESULTS_TTL
+
+
+def test_alternatives_table_refresh_and_lookup(upstreams):
+    assert webhook.refresh_alternative_destinations(["NAT"]) == 1
+
+    alternatives = webhook.get_alternative_destinations("NAT")
+    assert [a["code"] for a in alternatives] == ["SSA", "REC", "FOR", "POA", "XXX", "CWB"]
+    # Destinos fora da base local aparecem com o próprio código
+    assert alternatives[4]["city"] == "XXX"
+
+    mark = upstreams.snapshot()
+    webhook.get_alternative_destinations("NAT")
+    assert upstreams.usage_since(mark)["travelpayouts"] == 0
+
+
+def test_alternatives_for_origin_outside_table_are_fetched_once(upstreams):
+    assert [a["code"] for a in webhook.get_alternative_destinations("LIS")][:2] == ["SSA", "REC"]
+
+    mark = upstreams.snapshot()
+    webhook.get_alternative_destinations("LIS")
+    assert upstreams.usage_since(mark)["travelpayouts"] == 0
+
+
+def test_flows_leave_expected_state(upstreams):
+    upstreams.routes_with_data.update(ROUTES_WITH_DATA)
+    run_flow(upstreams, FLOWS["monitor_with_data"])
+
+    monitors = json.loads(upstreams.store[f"monitors:{USER_ID}"])
+    assert [(m["origin"], m["destination"], m["max_price"]) for m in monitors] == [("GRU", "GIG", 1500.0)]
+    assert json.loads(upstreams.store[f"state:{USER_ID}"]) is None